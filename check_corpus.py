@@ -1,5 +1,7 @@
-import sqlite3
-conn = sqlite3.connect("data/raw/rhowardstone/full_text_corpus.db")
-tables = conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name").fetchall()
-for name, t in tables:
-    print(f"  {t}: {name}")
\ No newline at end of file
+import sqlite3
+from contextlib import closing
+
+with closing(sqlite3.connect("data/raw/rhowardstone/full_text_corpus.db")) as conn:
+    for name, t in conn.execute("SELECT name, type FROM sqlite_master WHERE type IN (?, ?) ORDER BY name",
+                                ("table", "view")):
+        print(f"  {t}: {name}")
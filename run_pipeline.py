@@ -8,6 +8,8 @@ Usage:
     python run_pipeline.py --skip-doc-explorer  # Skip if LFS not pulled
     python run_pipeline.py --analysis-only    # Skip ingestion, re-run analysis
     python run_pipeline.py --cleanup-only     # Re-run entity cleanup + analysis
+    python run_pipeline.py --jobs 1           # Run analysis steps one at a time
+    python run_pipeline.py --isolated         # Run every step in its own interpreter
 
 Output:
     data/output/ecare.db           — Unified SQLite database
@@ -18,9 +20,14 @@ Output:
 import subprocess
 import sys
 import argparse
+import importlib
 import os
 import time
+import traceback
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from src.utils.common import get_db_connection, DEFAULT_DB_PATH
 
 
 INGEST_STEPS = [
@@ -38,17 +45,45 @@ CLEANUP_STEPS = [
     ("Entity cleanup & merge",        "python src/resolve/merge_entities.py"),
 ]
 
+# Analysis steps carry their dependencies (by description). Corpus integration
+# adds relationships + metadata, so everything reads after it; prioritize reads
+# the CSVs the others write. Corroboration (document_ids) and contradictions
+# (conflicts) both write to the DB, so contradictions waits for corroboration;
+# gap analysis, coverage and temporal only read (plus their pipeline_runs
+# entry) and run alongside either.
 ANALYSIS_STEPS = [
-    ("Corpus integration",            "python src/analyze/corpus_integration.py"),
-    ("Corroboration scoring",         "python src/analyze/corroboration.py"),
-    ("Gap analysis",                  "python src/analyze/gap_analysis.py"),
-    ("Document coverage analysis",    "python src/analyze/document_coverage.py"),
-    ("Temporal analysis",             "python src/analyze/temporal.py"),
-    ("Contradiction detection",       "python src/analyze/contradictions.py"),
-    ("Research priorities",           "python src/analyze/prioritize.py"),
+    ("Corpus integration",            "python src/analyze/corpus_integration.py", ()),
+    ("Corroboration scoring",         "python src/analyze/corroboration.py",      ("Corpus integration",)),
+    ("Gap analysis",                  "python src/analyze/gap_analysis.py",       ("Corpus integration",)),
+    ("Document coverage analysis",    "python src/analyze/document_coverage.py",  ("Corpus integration",)),
+    ("Temporal analysis",             "python src/analyze/temporal.py",           ("Corpus integration",)),
+    ("Contradiction detection",       "python src/analyze/contradictions.py",
+     ("Corpus integration", "Corroboration scoring")),
+    ("Research priorities",           "python src/analyze/prioritize.py",
+     ("Corroboration scoring", "Gap analysis", "Document coverage analysis", "Contradiction detection")),
 ]
 
 
+# In-process entry point for each step script: (function name, keyword arguments).
+# Serial steps are imported and called directly instead of paying interpreter
+# startup + package import per step; --isolated falls back to the commands above.
+ENTRY_POINTS = {
+    "src/utils/create_db.py":             ("create_database", {"db_path": "data/output/ecare.db", "force": True}),
+    "src/ingest/ingest_rhowardstone.py":  ("main", {}),
+    "src/ingest/ingest_epstein_docs.py":  ("main", {}),
+    "src/ingest/ingest_doc_explorer.py":  ("main", {}),
+    "src/utils/validate.py":              ("run_validation", {"db_path": "data/output/ecare.db"}),
+    "src/resolve/merge_entities.py":      ("main", {}),
+    "src/analyze/corpus_integration.py":  ("main", {}),
+    "src/analyze/corroboration.py":       ("compute_corroboration", {}),
+    "src/analyze/gap_analysis.py":        ("run_gap_analysis", {}),
+    "src/analyze/document_coverage.py":   ("run_document_coverage", {}),
+    "src/analyze/temporal.py":            ("run_temporal_analysis", {}),
+    "src/analyze/contradictions.py":      ("run_contradiction_detection", {}),
+    "src/analyze/prioritize.py":          ("run_prioritization", {}),
+}
+
+
 def print_summary():
     """Print final database summary."""
     db_path = "data/output/ecare.db"
@@ -90,6 +125,117 @@ def print_summary():
             print(f"    {f} ({size / 1024:.0f} KB)")
 
 
+def abort(returncode):
+    print(f"\nERROR: Step failed with return code {returncode}")
+    print("Pipeline aborted. Fix the error and re-run.")
+    sys.exit(1)
+
+
+def run_in_process(command, conn=None):
+    """Import the step's module and call its entry point. Returns a return code.
+
+    If `conn` is given it's passed through to the step, which then uses it
+    instead of opening (and closing) its own.
+    """
+    script = command.split()[1]
+    func_name, kwargs = ENTRY_POINTS[script]
+    if conn is not None:
+        kwargs = dict(kwargs, conn=conn)
+    try:
+        module = importlib.import_module(script[:-len(".py")].replace("/", "."))
+        getattr(module, func_name)(**kwargs)
+    except SystemExit as e:
+        # Some steps sys.exit() on missing inputs, same as they would standalone
+        if e.code in (None, 0):
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def run_serial_steps(steps, step_offset, total_steps, skip_doc_explorer=False, isolated=False,
+                     conn=None):
+    """Run steps one after another, streaming their output."""
+    for i, (description, command) in enumerate(steps, step_offset + 1):
+        if skip_doc_explorer and "doc-explorer" in command:
+            print(f"\n[{i}/{total_steps}] {description} — SKIPPED")
+            continue
+
+        print(f"\n[{i}/{total_steps}] {description}")
+        print("-" * 40)
+
+        step_start = time.time()
+        if isolated:
+            returncode = subprocess.run(command, shell=True).returncode
+        else:
+            returncode = run_in_process(command, conn)
+            sys.stdout.flush()
+        step_time = time.time() - step_start
+
+        if returncode != 0:
+            abort(returncode)
+
+        print(f"  Completed in {step_time:.1f}s")
+
+
+def _run_captured(command):
+    step_start = time.time()
+    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    return result.returncode, result.stdout, time.time() - step_start
+
+
+def run_analysis_steps(steps, step_offset, total_steps, jobs, isolated=False):
+    """Run analysis steps as a dependency DAG, up to `jobs` at a time.
+
+    Concurrent steps always run as subprocesses (separate stdout, no shared GIL).
+    Output of each step is captured and printed as a block when it finishes so
+    they don't interleave line by line.
+
+    With jobs=1 the steps run in-process on one shared connection, so its page
+    and statement caches stay warm from one step to the next.
+    """
+    if jobs <= 1:
+        serial = [(d, c) for d, c, _ in steps]
+        if isolated:
+            run_serial_steps(serial, step_offset, total_steps, isolated=True)
+            return
+        conn = get_db_connection(DEFAULT_DB_PATH)
+        try:
+            run_serial_steps(serial, step_offset, total_steps, conn=conn)
+        finally:
+            conn.close()
+        return
+
+    numbered = {d: (i, c, deps) for i, (d, c, deps) in enumerate(steps, step_offset + 1)}
+    pending = dict(numbered)
+    done = set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            ready = [d for d, (_, _, deps) in pending.items()
+                     if all(dep in done or dep not in numbered for dep in deps)]
+            for description in ready:
+                step_num, command, _ = pending.pop(description)
+                print(f"\n[{step_num}/{total_steps}] {description} — started")
+                running[pool.submit(_run_captured, command)] = description
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                description = running.pop(future)
+                returncode, output, step_time = future.result()
+                print(f"\n[{numbered[description][0]}/{total_steps}] {description}")
+                print("-" * 40)
+                print(output, end="")
+                if returncode != 0:
+                    abort(returncode)
+                print(f"  Completed in {step_time:.1f}s")
+                done.add(description)
+
+
 def main():
     parser = argparse.ArgumentParser(description="ECARE Pipeline Runner")
     parser.add_argument("--skip-doc-explorer", action="store_true",
@@ -98,6 +244,10 @@ def main():
                         help="Skip ingestion + cleanup, re-run analysis only")
     parser.add_argument("--cleanup-only", action="store_true",
                         help="Skip ingestion, re-run cleanup + analysis")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Max analysis steps to run concurrently (default: CPU count)")
+    parser.add_argument("--isolated", action="store_true",
+                        help="Run every step as a separate Python process")
     args = parser.parse_args()
 
     pipeline_start = time.time()
@@ -107,35 +257,19 @@ def main():
     print("=" * 60)
 
     if args.analysis_only:
-        steps = ANALYSIS_STEPS
+        serial_steps = []
         print("\nMode: analysis-only (using existing database)")
     elif args.cleanup_only:
-        steps = CLEANUP_STEPS + ANALYSIS_STEPS
+        serial_steps = CLEANUP_STEPS
         print("\nMode: cleanup + analysis (using existing database)")
     else:
-        steps = INGEST_STEPS + VALIDATE_STEP + CLEANUP_STEPS + ANALYSIS_STEPS
+        serial_steps = INGEST_STEPS + VALIDATE_STEP + CLEANUP_STEPS
 
-    step_num = 0
-    for description, command in steps:
-        step_num += 1
-
-        if args.skip_doc_explorer and "doc-explorer" in command:
-            print(f"\n[{step_num}/{len(steps)}] {description} — SKIPPED")
-            continue
-
-        print(f"\n[{step_num}/{len(steps)}] {description}")
-        print("-" * 40)
-
-        step_start = time.time()
-        result = subprocess.run(command, shell=True)
-        step_time = time.time() - step_start
-
-        if result.returncode != 0:
-            print(f"\nERROR: Step failed with return code {result.returncode}")
-            print("Pipeline aborted. Fix the error and re-run.")
-            sys.exit(1)
-
-        print(f"  Completed in {step_time:.1f}s")
+    total_steps = len(serial_steps) + len(ANALYSIS_STEPS)
+    run_serial_steps(serial_steps, 0, total_steps,
+                     skip_doc_explorer=args.skip_doc_explorer, isolated=args.isolated)
+    run_analysis_steps(ANALYSIS_STEPS, len(serial_steps), total_steps, args.jobs,
+                       isolated=args.isolated)
 
     total_time = time.time() - pipeline_start
 
@@ -14,50 +14,147 @@ Usage:
 """
 
 import csv
-import json
 import os
 import sys
 import argparse
-from collections import defaultdict
+import itertools
+import operator
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from src.utils.common import get_db_connection, now_iso, log_pipeline_run, DEFAULT_DB_PATH
 
 OUTPUT_DIR = "data/output"
 
-
-def detect_relationship_type_conflicts(conn):
+CSV_FIELDS = (
+    "record_type", "record_id", "entity_a", "entity_b",
+    "source_a", "source_b", "field", "value_a", "value_b", "severity",
+)
+
+# Sort rank per severity, stored on each conflict as "_sev" when it's created
+SEVERITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+# Vague categories that never conflict with each other (e.g. "associate" vs
+# "other"), only with something more specific
+TRIVIAL_CATEGORIES = frozenset({"associate", "other"})
+
+
+# Both detectors are fed from one UNION ALL statement. Every row (sqlite3.Row,
+# read by column name) has the same shape:
+# (kind, key, name_a, name_b, value, source_system, detail, seq), ordered
+# by kind ('rel' block first), then key, then seq within a key.
+#
+#   rel: key=relationship_id, value=canonical relationship_type,
+#        detail=source_relationship_type, seq=relationship_sources.id
+#   ent: key=canonical_id, value=top epstein-docs observed role,
+#        detail=source category, seq=entity_resolution_log.resolution_id
+#
+# rel candidates: SQLite narrows things down to relationships whose source rows
+# carry more than one distinct type; only those can conflict. The Python pass
+# still applies the exact per-system rule to the (much smaller) detail set.
+#
+# ent top role: observed_roles is reduced in SQL (json_each + ROW_NUMBER) so
+# entity metadata never has to be decoded in Python; ties go to the first key
+# in the object, same as max(). The source category is pulled out of
+# match_details with json_extract for the same reason (category, falling back
+# to entity_type_key; empty strings count as missing). Rows without one are
+# still returned — they count toward the 2+ sources rule.
+CANDIDATES_CTE = """
+    candidates AS (
+        SELECT rs.relationship_id
+        FROM relationship_sources rs
+        JOIN relationships r ON r.relationship_id = rs.relationship_id
+        GROUP BY rs.relationship_id
+        HAVING COUNT(DISTINCT COALESCE(NULLIF(rs.source_relationship_type, ''),
+                                       r.relationship_type)) > 1
+    )"""
+
+TOP_ROLES_CTE = """
+    top_roles AS (
+        SELECT canonical_id, role AS top_role
+        FROM (
+            SELECT ce.canonical_id, r.key AS role,
+                   ROW_NUMBER() OVER (PARTITION BY ce.canonical_id
+                                      ORDER BY r.value DESC, r.id) AS rn
+            FROM canonical_entities ce, json_each(ce.metadata, '$.observed_roles') r
+            WHERE ce.entity_type = 'person'
+              AND ce.metadata LIKE '%observed_roles%'
+        )
+        WHERE rn = 1
+    )"""
+
+REL_ROWS_SQL = """
+    SELECT 'rel' AS kind, r.relationship_id AS key,
+           ce1.canonical_name AS name_a, ce2.canonical_name AS name_b,
+           r.relationship_type AS value, rs.source_system,
+           rs.source_relationship_type AS detail, rs.id AS seq
+    FROM candidates c
+    JOIN relationships r ON r.relationship_id = c.relationship_id
+    JOIN canonical_entities ce1 ON r.source_entity_id = ce1.canonical_id
+    JOIN canonical_entities ce2 ON r.target_entity_id = ce2.canonical_id
+    JOIN relationship_sources rs ON r.relationship_id = rs.relationship_id"""
+
+ENT_ROWS_SQL = """
+    SELECT 'ent' AS kind, ce.canonical_id AS key,
+           ce.canonical_name AS name_a, NULL AS name_b,
+           tr.top_role AS value, erl.source_system,
+           COALESCE(NULLIF(json_extract(erl.match_details, '$.category'), ''),
+                    NULLIF(json_extract(erl.match_details, '$.entity_type_key'), '')) AS detail,
+           erl.resolution_id AS seq
+    FROM canonical_entities ce
+    JOIN entity_resolution_log erl ON ce.canonical_id = erl.canonical_id
+    LEFT JOIN top_roles tr ON tr.canonical_id = ce.canonical_id
+    WHERE ce.entity_type = 'person'"""
+
+
+def fetch_conflict_candidates(conn):
+    """Run the combined candidate query. Returns a streaming cursor (or empty iterator)."""
+    ctes, selects = [], []
+
+    # Relationship type conflicts are between source systems; with fewer than
+    # two there are none.
+    n_systems = conn.execute("SELECT COUNT(DISTINCT source_system) FROM relationship_sources").fetchone()[0]
+    if n_systems >= 2:
+        ctes.append(CANDIDATES_CTE)
+        selects.append(REL_ROWS_SQL)
+    else:
+        print(f"    Only {n_systems} source system(s) in relationship_sources — skipping relationship types")
+
+    # Entity categories need at least one entity with 2+ resolution log rows.
+    # (Not a source_system count: a single system's category can still clash
+    # with the epstein-docs observed role.)
+    if conn.execute("""
+        SELECT 1 FROM entity_resolution_log GROUP BY canonical_id HAVING COUNT(*) > 1 LIMIT 1
+    """).fetchone():
+        ctes.append(TOP_ROLES_CTE)
+        selects.append(ENT_ROWS_SQL)
+    else:
+        print("    No entity has more than one resolution entry — skipping entity categories")
+
+    if not selects:
+        return iter(())
+
+    cur = conn.execute(
+        "WITH" + ",".join(ctes) + "\nUNION ALL".join(selects)
+        + "\n    ORDER BY kind DESC, key, seq"
+    )
+    cur.arraysize = 1000
+    return cur
+
+
+def detect_relationship_type_conflicts(rows):
     """Find entity pairs where different sources assign different relationship types."""
-    print("\n  Checking for relationship type conflicts...")
-
-    # Get relationships with multiple source entries
-    rows = conn.execute("""
-        SELECT r.relationship_id,
-               ce1.canonical_name as source_name,
-               ce2.canonical_name as target_name,
-               r.relationship_type as canonical_type,
-               rs.source_system,
-               rs.source_relationship_type
-        FROM relationships r
-        JOIN canonical_entities ce1 ON r.source_entity_id = ce1.canonical_id
-        JOIN canonical_entities ce2 ON r.target_entity_id = ce2.canonical_id
-        JOIN relationship_sources rs ON r.relationship_id = rs.relationship_id
-        ORDER BY r.relationship_id
-    """).fetchall()
-
-    # Group by relationship_id
-    by_rel = defaultdict(list)
-    for row in rows:
-        by_rel[row[0]].append({
-            "source_name": row[1],
-            "target_name": row[2],
-            "canonical_type": row[3],
-            "source_system": row[4],
-            "source_rel_type": row[5],
-        })
-
+    # Rows arrive ordered by relationship_id, so stream them one group at a time
+    # instead of materializing the whole join.
     conflicts = []
-    for rel_id, sources in by_rel.items():
+    severity_counts = dict.fromkeys(SEVERITY_RANK, 0)
+    for rel_id, group in itertools.groupby(rows, key=operator.itemgetter("key")):
+        sources = [{
+            "source_name": row["name_a"],
+            "target_name": row["name_b"],
+            "canonical_type": row["value"],
+            "source_system": row["source_system"],
+            "source_rel_type": row["detail"],
+        } for row in group]
         if len(sources) < 2:
             continue
 
@@ -82,64 +179,44 @@ def detect_relationship_type_conflicts(conn):
                 "value_a": type_by_source[systems[0]],
                 "value_b": type_by_source[systems[1]] if len(systems) > 1 else "",
                 "severity": "low",  # type differences are common and usually just granularity
+                "_sev": SEVERITY_RANK["low"],
             })
+            severity_counts["low"] += 1
 
-    print(f"    Relationship type conflicts: {len(conflicts)}")
-    return conflicts
+    return conflicts, severity_counts
 
 
-def detect_entity_category_conflicts(conn):
+def detect_entity_category_conflicts(rows):
     """Find entities where different sources assigned different categories/roles."""
-    print("\n  Checking for entity category conflicts...")
-
-    # Get entities that appear in multiple sources
-    rows = conn.execute("""
-        SELECT ce.canonical_id, ce.canonical_name, ce.metadata,
-               erl.source_system, erl.match_details
-        FROM canonical_entities ce
-        JOIN entity_resolution_log erl ON ce.canonical_id = erl.canonical_id
-        WHERE ce.entity_type = 'person'
-        ORDER BY ce.canonical_id
-    """).fetchall()
-
-    # Group by canonical_id
-    by_entity = defaultdict(list)
-    for row in rows:
-        by_entity[(row[0], row[1])].append({
-            "source_system": row[3],
-            "match_details": row[4],
-            "metadata": row[2],
-        })
-
+    # Stream one canonical entity at a time (rows are ordered by canonical_id).
     conflicts = []
-    for (cid, cname), sources in by_entity.items():
+    severity_counts = dict.fromkeys(SEVERITY_RANK, 0)
+    for (cid, cname, top_role), group in itertools.groupby(
+            rows, key=operator.itemgetter("key", "name_a", "value")):
+        sources = [{
+            "source_system": row["source_system"],
+            "category": row["detail"],
+        } for row in group]
         if len(sources) < 2:
             continue
 
         # Extract categories from different sources
         categories = {}
         for s in sources:
-            sys_name = s["source_system"]
-            details = json.loads(s["match_details"]) if s["match_details"] else {}
-            cat = details.get("category") or details.get("entity_type_key")
-            if cat:
-                categories[sys_name] = cat
+            if s["category"]:
+                categories[s["source_system"]] = s["category"]
 
         # Check for roles from epstein-docs
-        meta = json.loads(sources[0]["metadata"]) if sources[0]["metadata"] else {}
-        observed_roles = meta.get("observed_roles", {})
-        if observed_roles:
-            top_role = max(observed_roles, key=observed_roles.get)
+        if top_role:
             categories["epstein-docs_role"] = top_role
 
-        # See if there are genuine conflicts
+        # See if there are genuine conflicts. Two or more distinct values
+        # conflict unless every one of them is trivial.
         unique_cats = set(categories.values())
         if len(unique_cats) > 1:
-            # Filter out trivial conflicts (e.g., "associate" vs "business" — both are vague)
-            trivial = {"associate", "other"}
-            non_trivial = unique_cats - trivial
-            if len(non_trivial) > 1 or (non_trivial and unique_cats - non_trivial):
+            if not unique_cats <= TRIVIAL_CATEGORIES:
                 systems = sorted(categories.keys())
+                severity = "medium" if "victim" in unique_cats or "perpetrator" in unique_cats else "low"
                 conflicts.append({
                     "record_type": "entity",
                     "record_id": cid,
@@ -150,59 +227,76 @@ def detect_entity_category_conflicts(conn):
                     "field": "category/role",
                     "value_a": categories[systems[0]],
                     "value_b": categories[systems[1]] if len(systems) > 1 else "",
-                    "severity": "medium" if "victim" in unique_cats or "perpetrator" in unique_cats else "low",
+                    "severity": severity,
+                    "_sev": SEVERITY_RANK[severity],
                 })
+                severity_counts[severity] += 1
 
-    print(f"    Entity category conflicts: {len(conflicts)}")
-    return conflicts
+    return conflicts, severity_counts
 
 
-def run_contradiction_detection(db_path: str = DEFAULT_DB_PATH):
+DETECTORS = {
+    "rel": detect_relationship_type_conflicts,
+    "ent": detect_entity_category_conflicts,
+}
+
+
+def run_contradiction_detection(db_path: str = DEFAULT_DB_PATH, conn=None):
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Running cross-source contradiction detection...")
+    print("\n  Checking for relationship type and entity category conflicts...")
 
-    rel_conflicts = detect_relationship_type_conflicts(conn)
-    entity_conflicts = detect_entity_category_conflicts(conn)
+    found = {kind: ([], {}) for kind in DETECTORS}
+    for kind, rows in itertools.groupby(fetch_conflict_candidates(conn), key=operator.itemgetter("kind")):
+        found[kind] = DETECTORS[kind](rows)
+    (rel_conflicts, rel_sev), (entity_conflicts, entity_sev) = found["rel"], found["ent"]
+    sev = {k: rel_sev.get(k, 0) + entity_sev.get(k, 0) for k in SEVERITY_RANK}
+    print(f"    Relationship type conflicts: {len(rel_conflicts)}")
+    print(f"    Entity category conflicts: {len(entity_conflicts)}")
 
     all_conflicts = rel_conflicts + entity_conflicts
-    all_conflicts.sort(key=lambda x: {"high": 0, "medium": 1, "low": 2}.get(x["severity"], 3))
+    all_conflicts.sort(key=operator.itemgetter("_sev"))
+
+    # One tuple per conflict, in CSV column order. The same tuples feed both the
+    # CSV writer and the conflicts INSERT (which picks its columns by number).
+    rows = [tuple(c[k] for k in CSV_FIELDS) for c in all_conflicts]
 
     output_path = os.path.join(OUTPUT_DIR, "cross_source_contradictions.csv")
     with open(output_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            "record_type", "record_id", "entity_a", "entity_b",
-            "source_a", "source_b", "field", "value_a", "value_b", "severity"
-        ])
-        writer.writeheader()
-        writer.writerows(all_conflicts)
-
-    # Also write to conflicts table in database
-    for c in all_conflicts:
-        conn.execute("""
-            INSERT INTO conflicts (entity_or_relationship, record_id, source_a, source_b,
-                                   field_in_conflict, value_a, value_b, nature_of_conflict,
-                                   resolution_status, flagged_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'unresolved', ?)
-        """, (c["record_type"], c["record_id"], c["source_a"], c["source_b"],
-              c["field"], c["value_a"], c["value_b"],
-              f"severity: {c['severity']}", now_iso()))
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows(rows)
+
+    # Also write to conflicts table in database (one prepared statement, one transaction)
+    flagged = now_iso()
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("""
+        INSERT INTO conflicts (entity_or_relationship, record_id, source_a, source_b,
+                               field_in_conflict, value_a, value_b, nature_of_conflict,
+                               resolution_status, flagged_date)
+        VALUES (?1, ?2, ?5, ?6, ?7, ?8, ?9, 'severity: ' || ?10, 'unresolved', ?11)
+    """, (row + (flagged,) for row in rows))
     conn.commit()
 
     print(f"\n  Total contradictions: {len(all_conflicts)}")
-    from collections import Counter
-    sev = Counter(c["severity"] for c in all_conflicts)
-    for s, count in sev.most_common():
-        print(f"    {s}: {count}")
+    for s, count in sorted(sev.items(), key=lambda kv: -kv[1]):
+        if count:
+            print(f"    {s}: {count}")
     print(f"\n  Output: {output_path}")
 
     log_pipeline_run(conn, "contradiction_detection", "completed",
                      records_processed=len(all_conflicts),
                      notes=f"{len(all_conflicts)} contradictions detected",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 if __name__ == "__main__":
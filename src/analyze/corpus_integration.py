@@ -17,6 +17,7 @@ Usage:
     python src/analyze/corpus_integration.py
     python src/analyze/corpus_integration.py --corpus-path /path/to/full_text_corpus.db
     python src/analyze/corpus_integration.py --top-n 500  # limit entity count
+    python src/analyze/corpus_integration.py --workers 4  # corpus query threads
 """
 
 import json
@@ -24,18 +25,113 @@ import os
 import sys
 import sqlite3
 import argparse
+import functools
+import itertools
+import operator
+import pathlib
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from src.utils.common import (
-    get_db_connection, now_iso, log_pipeline_run,
-    insert_relationship, insert_relationship_source,
-    find_existing_relationship, DEFAULT_DB_PATH
+    get_db_connection, loads_json, now_iso, log_pipeline_run,
+    insert_relationship, insert_relationship_source, insert_relationship_sources,
+    DEFAULT_DB_PATH
 )
 
 CORPUS_DB_PATH = "data/raw/rhowardstone/full_text_corpus.db"
 
+# Step 1 searches this many persons' names per corpus_search_batch call
+PERSONS_PER_BATCH = 16
+
+# Step 1 metadata UPDATEs are flushed (one executemany + commit) this often
+UPDATE_FLUSH_SIZE = 500
+
+# Threads running co-occurrence queries in steps 2/3. SQLite releases the GIL
+# while it steps a statement, so read-only FTS5 queries scale across threads.
+CORPUS_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+# Each pool thread's own read-only corpus connection
+_corpus_local = threading.local()
+
+# Corpus connections read FTS5 segments straight out of a memory map. SQLite
+# clamps the request to its compile-time maximum (often 2 GB); connect_corpus
+# reports what it actually got. Page cache sizes are in KiB: the step 1
+# connection gets a large one, each pool thread a smaller one.
+CORPUS_MMAP_SIZE = 8 * 1024**3
+CORPUS_CACHE_KIB = 524288
+CORPUS_WORKER_CACHE_KIB = 200000
+
+# Names matching more pages than this aren't kept in the step 1 page index
+# (memory bound); pairs involving them go back to a MATCH query.
+CORPUS_INDEX_MAX_PAGES = 200_000
+
+# Failed corpus queries so far (all threads); the first CORPUS_FAILURE_PLANS
+# also get their query plan printed
+_corpus_failures = 0
+_corpus_failures_lock = threading.Lock()
+CORPUS_FAILURE_PLANS = 3
+
+# Step 3 only links a pair when they share at least this many documents
+MIN_DISCOVERY_DOCS = 3
+
+
+class CorpusIndex:
+    """Page-level FTS5 hits from step 1, reused for co-occurrence in steps 2/3.
+
+    Holds the pages_fts rowids each searched name matched. Two names co-occur
+    on exactly the pages in the intersection of their sets, i.e. the rows
+    MATCH '"a" AND "b"' would return, so most pairs never go back to FTS5.
+    """
+
+    def __init__(self, max_pages=CORPUS_INDEX_MAX_PAGES):
+        self.max_pages = max_pages
+        self.name_pages = {}  # name -> frozenset of pages_fts rowids
+        self.page_docs = {}   # pages_fts rowid -> efta_number
+
+    def add(self, name, hits):
+        """Record a name's (rowid, efta_number) hits."""
+        if len(hits) > self.max_pages:
+            return
+        self.name_pages[name] = frozenset(rowid for rowid, _ in hits)
+        self.page_docs.update(hits)
+
+    def cooccurrence(self, name_a, name_b, min_docs=0):
+        """Set of EFTA numbers where both names appear, or None if either wasn't indexed.
+
+        Pairs that provably share fewer than `min_docs` documents come back as an
+        empty set instead: fewer shared pages than that, or (when only one name
+        was indexed) fewer pages for that name alone. A page holds one document,
+        so the page count bounds the document count.
+        """
+        pages_a = self.name_pages.get(name_a)
+        pages_b = self.name_pages.get(name_b)
+        if pages_a is None or pages_b is None:
+            known = pages_b if pages_a is None else pages_a
+            if known is not None and len(known) < min_docs:
+                return set()
+            return None
+        shared = pages_a & pages_b
+        if len(shared) < min_docs:
+            return set()
+        return {self.page_docs[rowid] for rowid in shared}
+
+
+def open_corpus_connection(corpus_path, cache_kib, check_same_thread=True):
+    """Open the corpus read-only, with the PRAGMAs for FTS5-heavy reading.
+
+    Returns (connection, mmap size in effect in bytes).
+    """
+    uri = pathlib.Path(corpus_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{cache_kib}")
+    row = conn.execute(f"PRAGMA mmap_size={CORPUS_MMAP_SIZE}").fetchone()
+    return conn, (row[0] if row else 0)
+
 
 def connect_corpus(corpus_path):
     """Connect to corpus and verify it's a real database (not LFS pointer).
@@ -52,7 +148,7 @@ def connect_corpus(corpus_path):
         print("Skipping corpus integration.")
         return None, False
 
-    conn = sqlite3.connect(corpus_path)
+    conn, mmap_size = open_corpus_connection(corpus_path, CORPUS_CACHE_KIB)
 
     # Detect FTS5 — rhowardstone uses a separate pages_fts table
     has_fts = False
@@ -70,89 +166,299 @@ def connect_corpus(corpus_path):
     print(f"  Documents: {doc_count:,}")
     print(f"  Pages: {page_count:,}")
     print(f"  FTS5: {'yes' if has_fts else 'no (will use LIKE — much slower)'}")
+    print(f"  mmap: {mmap_size / (1024**3):.1f} GB" if mmap_size else "  mmap: unavailable")
 
     return conn, has_fts
 
 
-def corpus_search(corpus_conn, name, has_fts):
-    """Search corpus for a name. Returns set of EFTA numbers."""
+def open_corpus_pool(corpus_path, workers=CORPUS_WORKERS):
+    """Thread pool whose workers each open their own read-only corpus connection.
+
+    Returns (pool, connections); close the connections after shutting down the pool.
+    """
+    connections = []
+    lock = threading.Lock()
+
+    def init_worker():
+        conn, _ = open_corpus_connection(corpus_path, CORPUS_WORKER_CACHE_KIB, check_same_thread=False)
+        _corpus_local.conn = conn
+        with lock:
+            connections.append(conn)
+
+    return ThreadPoolExecutor(max_workers=workers, initializer=init_worker), connections
+
+
+@functools.lru_cache(maxsize=None)
+def fts_quote(name):
+    """A name as an FTS5 phrase: double-quoted, with embedded double quotes doubled.
+
+    Unescaped, a name like 'James "Whitey" Bulger' made the MATCH a syntax
+    error, which the callers' except clauses turned into zero documents.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def fts_and(name_a, name_b):
+    """MATCH expression for pages containing both names."""
+    return f"{fts_quote(name_a)} AND {fts_quote(name_b)}"
+
+
+def corpus_query_set(corpus_conn, sql, params):
+    """Run a corpus query; returns the set of its first column.
+
+    An OperationalError (bad MATCH expression, lock timeout, I/O error) is
+    reported and counts as no documents, so the run carries on — but it's no
+    longer silent. The first few failures also print the statement's query
+    plan, to show whether FTS5 is still being used through its index.
+    """
+    global _corpus_failures
     try:
-        if has_fts:
-            rows = corpus_conn.execute(
-                'SELECT DISTINCT efta_number FROM pages_fts WHERE pages_fts MATCH ?',
-                (f'"{name}"',)
-            ).fetchall()
-        else:
-            rows = corpus_conn.execute(
-                "SELECT DISTINCT efta_number FROM pages WHERE text_content LIKE ?",
-                (f"%{name}%",)
-            ).fetchall()
-        return {r[0] for r in rows}
-    except Exception:
+        return {r[0] for r in corpus_conn.execute(sql, params)}
+    except sqlite3.OperationalError as e:
+        with _corpus_failures_lock:
+            _corpus_failures += 1
+            n = _corpus_failures
+        print(f"  WARNING: corpus query failed: {e} (params: {params!r})")
+        if n <= CORPUS_FAILURE_PLANS:
+            try:
+                plan = corpus_conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                for row in plan:
+                    print(f"    plan: {row[-1]}")
+            except sqlite3.Error as plan_error:
+                print(f"    plan unavailable: {plan_error}")
         return set()
 
 
+def corpus_search(corpus_conn, name, has_fts):
+    """Search corpus for a name. Returns set of EFTA numbers."""
+    if has_fts:
+        return corpus_query_set(
+            corpus_conn,
+            "SELECT DISTINCT efta_number FROM pages_fts WHERE pages_fts MATCH ?",
+            (fts_quote(name),)
+        )
+    return corpus_query_set(
+        corpus_conn,
+        "SELECT DISTINCT efta_number FROM pages WHERE text_content LIKE ?",
+        (f"%{name}%",)
+    )
+
+
+def corpus_search_batch(corpus_conn, names, has_fts, batch_size=32, index=None):
+    """Search corpus for many names. Returns dict name -> set of EFTA numbers.
+
+    With FTS5, each batch of names goes out as one statement: a UNION ALL of
+    per-name MATCH subqueries, each tagged with the name's position in the
+    batch so rows can be split back out exactly. If a batch fails, its names
+    are retried one at a time through corpus_search.
+    Page hits for the batched names are also recorded in `index` if given.
+    """
+    results = {name: set() for name in names}
+    unique = list(results)
+    if not has_fts:
+        # LIKE scans the whole table per name either way; nothing to batch
+        for name in unique:
+            results[name] = corpus_search(corpus_conn, name, has_fts)
+        return results
+
+    for start in range(0, len(unique), batch_size):
+        batch = unique[start:start + batch_size]
+        sql = "\nUNION ALL\n".join(
+            f"SELECT {i}, rowid, efta_number FROM pages_fts WHERE pages_fts MATCH ?"
+            for i in range(len(batch))
+        )
+        try:
+            rows = corpus_conn.execute(sql, [fts_quote(name) for name in batch]).fetchall()
+        except sqlite3.OperationalError:
+            # Retried per name so a failure is reported against its own MATCH
+            for name in batch:
+                results[name] = corpus_search(corpus_conn, name, has_fts)
+            continue
+        hits = defaultdict(list)
+        for i, rowid, efta in rows:
+            hits[i].append((rowid, efta))
+        for i, name in enumerate(batch):
+            results[name] = {efta for _, efta in hits[i]}
+            if index is not None:
+                index.add(name, hits[i])
+    return results
+
+
 def corpus_cooccurrence(corpus_conn, name_a, name_b, has_fts):
     """Find documents where both names appear. Returns set of EFTA numbers."""
+    if has_fts:
+        # MATCH is kept inside its own CTE so the planner stays on the FTS5
+        # index instead of folding it into an outer scan
+        return corpus_query_set(
+            corpus_conn,
+            """WITH m AS (SELECT DISTINCT efta_number FROM pages_fts WHERE pages_fts MATCH ?)
+               SELECT efta_number FROM m""",
+            (fts_and(name_a, name_b),)
+        )
+    return corpus_query_set(
+        corpus_conn,
+        """SELECT DISTINCT efta_number FROM pages
+           WHERE text_content LIKE ? AND text_content LIKE ?""",
+        (f"%{name_a}%", f"%{name_b}%")
+    )
+
+
+def corpus_cooccurrence_topk(corpus_conn, name_a, name_b, has_fts, k=25):
+    """Like corpus_cooccurrence, but stops after k distinct EFTA numbers.
+
+    For threshold checks ("at least k shared documents"): with the LIMIT the
+    FTS5 cursor stops walking the posting intersection once k are found.
+    """
+    if has_fts:
+        return corpus_query_set(
+            corpus_conn,
+            """WITH m AS (SELECT DISTINCT efta_number FROM pages_fts WHERE pages_fts MATCH ? LIMIT ?)
+               SELECT efta_number FROM m""",
+            (fts_and(name_a, name_b), k)
+        )
+    return corpus_query_set(
+        corpus_conn,
+        """SELECT DISTINCT efta_number FROM pages
+           WHERE text_content LIKE ? AND text_content LIKE ? LIMIT ?""",
+        (f"%{name_a}%", f"%{name_b}%", k)
+    )
+
+
+def search_names_for(cname, search_aliases):
+    """Name variants searched for a person: canonical name plus aliases, 4+ chars.
+
+    `search_aliases` is the JSON array built by PERSONS_SQL, already cut down to
+    the text aliases longer than 3 characters.
+    """
+    return [sname for sname in (cname, *loads_json(search_aliases)) if len(sname) >= 4]
+
+
+# Step 1 persons, most connected first. Aliases are flattened with json_each in
+# a per-person subquery (so the relationships join can't repeat them) and only
+# text aliases over 3 characters come back, as one JSON array. Anything that
+# isn't a valid JSON array counts as no aliases.
+PERSONS_SQL = """
+    SELECT ce.canonical_id, ce.canonical_name,
+           (SELECT json_group_array(j.value)
+            FROM json_each(CASE WHEN json_valid(ce.aliases) AND json_type(ce.aliases) = 'array'
+                                THEN ce.aliases END) j
+            WHERE j.type = 'text' AND length(j.value) > 3) AS search_aliases,
+           ce.metadata,
+           COUNT(DISTINCT r.relationship_id) as rel_count
+    FROM canonical_entities ce
+    LEFT JOIN relationships r ON r.source_entity_id = ce.canonical_id
+                              OR r.target_entity_id = ce.canonical_id
+    WHERE ce.entity_type = 'person'
+    GROUP BY ce.canonical_id
+    ORDER BY rel_count DESC, ce.canonical_id
+    LIMIT ?
+"""
+
+# Per-pair co-occurrence for every candidate in one statement: each temp row
+# carries its own MATCH expression, which FTS5 evaluates as the inner loop of
+# the join. Returns the document count and the first 20 EFTA numbers per pair.
+ATTACHED_COOCCURRENCE_SQL = """
+    SELECT rel_id, efta_number, n
+    FROM (
+        SELECT rel_id, efta_number,
+               ROW_NUMBER() OVER (PARTITION BY rel_id ORDER BY efta_number) AS rn,
+               COUNT(*) OVER (PARTITION BY rel_id) AS n
+        FROM (
+            SELECT DISTINCT c.rel_id, f.efta_number
+            FROM temp.corpus_candidates c
+            JOIN corpus.pages_fts f ON f.pages_fts MATCH c.query
+        )
+    )
+    WHERE rn <= 20
+    ORDER BY rel_id, rn
+"""
+
+
+def attached_cooccurrence(ecare_conn, corpus_path, pairs):
+    """Co-occurrence for many (rel_id, name_a, name_b) pairs via an attached corpus.
+
+    Returns dict rel_id -> (document_count, efta_sample) for pairs with at least
+    one shared document. Raises sqlite3.OperationalError if the attach or the
+    joined MATCH isn't possible; callers fall back to per-pair searches.
+    """
+    if ecare_conn.in_transaction:
+        ecare_conn.commit()  # ATTACH/DETACH can't run inside a transaction
+    ecare_conn.execute("ATTACH DATABASE ? AS corpus", (corpus_path,))
     try:
-        if has_fts:
-            rows = corpus_conn.execute(
-                'SELECT DISTINCT efta_number FROM pages_fts WHERE pages_fts MATCH ?',
-                (f'"{name_a}" AND "{name_b}"',)
-            ).fetchall()
-        else:
-            rows = corpus_conn.execute(
-                """SELECT DISTINCT efta_number FROM pages
-                   WHERE text_content LIKE ? AND text_content LIKE ?""",
-                (f"%{name_a}%", f"%{name_b}%")
-            ).fetchall()
-        return {r[0] for r in rows}
-    except Exception:
-        return set()
+        ecare_conn.execute("CREATE TEMP TABLE corpus_candidates (rel_id INTEGER PRIMARY KEY, query TEXT)")
+        ecare_conn.executemany(
+            "INSERT INTO temp.corpus_candidates (rel_id, query) VALUES (?, ?)",
+            ((rel_id, fts_and(name_a, name_b)) for rel_id, name_a, name_b in pairs)
+        )
+        found = {}
+        for rel_id, group in itertools.groupby(ecare_conn.execute(ATTACHED_COOCCURRENCE_SQL),
+                                               key=operator.itemgetter(0)):
+            group = list(group)
+            found[rel_id] = (group[0][2], [row[1] for row in group])
+        return found
+    finally:
+        ecare_conn.execute("DROP TABLE IF EXISTS temp.corpus_candidates")
+        ecare_conn.commit()
+        ecare_conn.execute("DETACH DATABASE corpus")
+
+
+def pooled_cooccurrence(name_a, name_b, has_fts):
+    """corpus_cooccurrence on the calling pool thread's own connection."""
+    return corpus_cooccurrence(_corpus_local.conn, name_a, name_b, has_fts)
+
+
+def pooled_cooccurrence_topk(name_a, name_b, has_fts, k):
+    """corpus_cooccurrence_topk on the calling pool thread's own connection."""
+    return corpus_cooccurrence_topk(_corpus_local.conn, name_a, name_b, has_fts, k)
 
 
 def step1_entity_mention_counts(ecare_conn, corpus_conn, has_fts, top_n):
-    """For each person, count how many corpus documents mention them."""
+    """For each person, count how many corpus documents mention them.
+
+    Returns (updated count, CorpusIndex of the searched names — None without FTS5).
+    """
     print(f"\n--- Step 1: Entity mention counts (top {top_n} by connections) ---")
 
     # Get persons ordered by connection count
-    persons = ecare_conn.execute("""
-        SELECT ce.canonical_id, ce.canonical_name, ce.aliases, ce.metadata,
-               COUNT(DISTINCT r.relationship_id) as rel_count
-        FROM canonical_entities ce
-        LEFT JOIN relationships r ON r.source_entity_id = ce.canonical_id
-                                  OR r.target_entity_id = ce.canonical_id
-        WHERE ce.entity_type = 'person'
-        GROUP BY ce.canonical_id
-        ORDER BY rel_count DESC
-        LIMIT ?
-    """, (top_n,)).fetchall()
+    persons = ecare_conn.execute(PERSONS_SQL, (top_n,)).fetchall()
 
     print(f"  Searching corpus for {len(persons)} persons...")
 
     updated = 0
+    updated_at = now_iso()  # one timestamp for the whole batch
+    pending_updates = []
     start = time.time()
     last_report = start
 
-    for i, (cid, cname, aliases_json, meta_json, rel_count) in enumerate(persons):
-        # Build search names
-        search_names = [cname]
-        if aliases_json:
-            try:
-                for alias in json.loads(aliases_json):
-                    if alias and len(alias) > 3:
-                        search_names.append(alias)
-            except (json.JSONDecodeError, TypeError):
-                pass
+    def flush_updates():
+        if ecare_conn.in_transaction:
+            ecare_conn.commit()
+        ecare_conn.execute("BEGIN IMMEDIATE")
+        ecare_conn.executemany(
+            "UPDATE canonical_entities SET metadata = ?, last_updated = ? WHERE canonical_id = ?",
+            pending_updates
+        )
+        ecare_conn.commit()
+        pending_updates.clear()
+
+    # Names for a chunk of persons are searched together (see corpus_search_batch)
+    # before the per-person pass below picks the best variant for each.
+    found = {}
+    corpus_index = CorpusIndex() if has_fts else None
+
+    for i, (cid, cname, search_aliases, meta_json, rel_count) in enumerate(persons):
+        if i % PERSONS_PER_BATCH == 0:
+            chunk_names = []
+            for _, chunk_cname, chunk_aliases, _, _ in persons[i:i + PERSONS_PER_BATCH]:
+                chunk_names.extend(search_names_for(chunk_cname, chunk_aliases))
+            found = corpus_search_batch(corpus_conn, chunk_names, has_fts, index=corpus_index)
 
         # Search each name variant, take the best count
         best_count = 0
         best_name = cname
         best_docs = set()
-        for sname in search_names:
-            if len(sname) < 4:
-                continue
-            docs = corpus_search(corpus_conn, sname, has_fts)
+        for sname in search_names_for(cname, search_aliases):
+            docs = found[sname]
             if len(docs) > best_count:
                 best_count = len(docs)
                 best_name = sname
@@ -160,15 +466,14 @@ def step1_entity_mention_counts(ecare_conn, corpus_conn, has_fts, top_n):
 
         if best_count > 0:
             # Update entity metadata with corpus mention count
-            meta = json.loads(meta_json) if meta_json else {}
+            meta = loads_json(meta_json) if meta_json else {}
             meta["corpus_document_count"] = best_count
             meta["corpus_search_term"] = best_name
 
-            ecare_conn.execute(
-                "UPDATE canonical_entities SET metadata = ?, last_updated = ? WHERE canonical_id = ?",
-                (json.dumps(meta), now_iso(), cid)
-            )
+            pending_updates.append((json.dumps(meta), updated_at, cid))
             updated += 1
+            if len(pending_updates) >= UPDATE_FLUSH_SIZE:
+                flush_updates()
 
         # Progress
         if time.time() - last_report > 15:
@@ -179,13 +484,15 @@ def step1_entity_mention_counts(ecare_conn, corpus_conn, has_fts, top_n):
                   f"({elapsed:.0f}s elapsed, ~{remaining:.0f}s remaining)")
             last_report = time.time()
 
-    ecare_conn.commit()
+    if pending_updates:
+        flush_updates()
     elapsed = time.time() - start
     print(f"  Done: {updated} entities with corpus mentions ({elapsed:.0f}s)")
-    return updated
+    return updated, corpus_index
 
 
-def step2_relationship_corroboration(ecare_conn, corpus_conn, has_fts, top_n):
+def step2_relationship_corroboration(ecare_conn, corpus_pool, has_fts, top_n, corpus_path=CORPUS_DB_PATH,
+                                     corpus_index=None):
     """For high-value relationships, check if both entities co-occur in corpus documents."""
     print(f"\n--- Step 2: Corpus co-occurrence corroboration ---")
 
@@ -213,48 +520,61 @@ def step2_relationship_corroboration(ecare_conn, corpus_conn, has_fts, top_n):
 
     print(f"  Checking {len(relationships)} relationships for corpus co-occurrence...")
 
-    corroborated = 0
-    new_relationships = 0
-    start = time.time()
-    last_report = start
+    # Relationships that already have corpus provenance, loaded once up front
+    # rather than checked with a SELECT per co-occurring pair
+    existing_corpus = {row[0] for row in ecare_conn.execute(
+        "SELECT DISTINCT relationship_id FROM relationship_sources WHERE source_system = 'corpus'"
+    )}
 
-    for i, (rel_id, src_cid, tgt_cid, rel_type, src_name, tgt_name, src_count) in enumerate(relationships):
-        # Search for documents mentioning both entities
-        co_docs = corpus_cooccurrence(corpus_conn, src_name, tgt_name, has_fts)
-
-        if co_docs:
-            # Check if corpus is already a source for this relationship
-            existing_corpus = ecare_conn.execute(
-                """SELECT id FROM relationship_sources
-                   WHERE relationship_id = ? AND source_system = 'corpus'""",
-                (rel_id,)
-            ).fetchone()
-
-            if not existing_corpus:
-                # Add corpus as a provenance source
-                # Limit stored EFTA list to 20 to avoid bloating the db
-                efta_sample = sorted(co_docs)[:20]
-                insert_relationship_source(
-                    ecare_conn, rel_id, "corpus",
-                    source_relationship_type="co_occurrence",
-                    source_evidence={
-                        "type": "full_text_corpus_co_occurrence",
-                        "document_count": len(co_docs),
-                        "efta_sample": efta_sample,
-                    },
-                    source_confidence=0.6,
-                    evidence_class="corpus_cooccurrence"
-                )
-                corroborated += 1
+    start = time.time()
 
-        # Progress
-        if time.time() - last_report > 15:
-            elapsed = time.time() - start
-            rate = (i + 1) / elapsed
-            remaining = (len(relationships) - i - 1) / rate if rate > 0 else 0
-            print(f"    {i + 1}/{len(relationships)} checked, {corroborated} corroborated "
-                  f"({elapsed:.0f}s elapsed, ~{remaining:.0f}s remaining)")
-            last_report = time.time()
+    # (document_count, efta_sample) for each relationship that gains a corpus
+    # source. Stored EFTA lists are limited to 20 to avoid bloating the db.
+    # Pairs whose names were both searched in step 1 are intersected in memory.
+    # With FTS5 the rest are matched in one statement against the attached
+    # corpus; otherwise (or if that fails) they're searched on the corpus pool.
+    # Either way all ecare writes stay on this thread.
+    found = {}
+    pending = []
+    for rel_id, _, _, _, src_name, tgt_name, _ in relationships:
+        if rel_id in existing_corpus:
+            continue
+        co_docs = corpus_index.cooccurrence(src_name, tgt_name) if corpus_index else None
+        if co_docs is None:
+            pending.append((rel_id, src_name, tgt_name))
+        elif co_docs:
+            found[rel_id] = (len(co_docs), sorted(co_docs)[:20])
+    print(f"  {len(pending)} pairs not covered by the step 1 index, searching corpus...")
+
+    searched = not pending
+    if has_fts and not searched:
+        try:
+            found.update(attached_cooccurrence(ecare_conn, corpus_path, pending))
+            searched = True
+        except sqlite3.OperationalError as e:
+            print(f"  Attached corpus query failed ({e}) — searching pair by pair")
+    if not searched:
+        co_docs_per_pair = corpus_pool.map(
+            pooled_cooccurrence,
+            [p[1] for p in pending], [p[2] for p in pending], [has_fts] * len(pending),
+        )
+        for (rel_id, _, _), co_docs in zip(pending, co_docs_per_pair):
+            if co_docs:
+                found[rel_id] = (len(co_docs), sorted(co_docs)[:20])
+
+    # Add corpus as a provenance source (one executemany, in relationship order)
+    new_sources = [
+        (rel_id, "corpus", None, "co_occurrence",
+         {
+             "type": "full_text_corpus_co_occurrence",
+             "document_count": found[rel_id][0],
+             "efta_sample": found[rel_id][1],
+         },
+         0.6, "corpus_cooccurrence")
+        for rel_id, *_ in relationships if rel_id in found
+    ]
+    insert_relationship_sources(ecare_conn, new_sources)
+    corroborated = len(new_sources)
 
     ecare_conn.commit()
     elapsed = time.time() - start
@@ -262,7 +582,7 @@ def step2_relationship_corroboration(ecare_conn, corpus_conn, has_fts, top_n):
     return corroborated
 
 
-def step3_discover_new_cooccurrences(ecare_conn, corpus_conn, has_fts, top_n_entities=100):
+def step3_discover_new_cooccurrences(ecare_conn, corpus_pool, has_fts, top_n_entities=100, corpus_index=None):
     """For the most prominent entities WITHOUT many relationships, find corpus co-occurrences."""
     print(f"\n--- Step 3: Discover new co-occurrences from corpus ---")
 
@@ -278,7 +598,7 @@ def step3_discover_new_cooccurrences(ecare_conn, corpus_conn, has_fts, top_n_ent
           AND json_extract(ce.metadata, '$.corpus_document_count') > 10
         GROUP BY ce.canonical_id
         HAVING rel_count < 5
-        ORDER BY doc_count DESC
+        ORDER BY doc_count DESC, ce.canonical_id
         LIMIT ?
     """, (top_n_entities,)).fetchall()
 
@@ -296,57 +616,83 @@ def step3_discover_new_cooccurrences(ecare_conn, corpus_conn, has_fts, top_n_ent
                              OR r.target_entity_id = ce.canonical_id
         WHERE ce.entity_type = 'person'
         GROUP BY ce.canonical_id
-        ORDER BY COUNT(DISTINCT r.relationship_id) DESC
+        ORDER BY COUNT(DISTINCT r.relationship_id) DESC, ce.canonical_id
         LIMIT 50
     """).fetchall()
 
+    # Every connected pair (either direction, any relationship type), loaded
+    # once so candidates are filtered in memory instead of two lookups per pair
+    existing_pairs = {frozenset(pair) for pair in ecare_conn.execute(
+        "SELECT source_entity_id, target_entity_id FROM relationships"
+    )}
+
     new_rels = 0
     start = time.time()
 
+    # Unconnected (entity, hub) pairs, each unordered pair once. Co-occurrence
+    # is symmetric, so a reversed duplicate could never add anything.
+    candidates = []
     for cid, cname, doc_count, rel_count in entities:
         for hub_cid, hub_name in hubs:
             if cid == hub_cid:
                 continue
 
-            # Check if relationship already exists
-            existing = find_existing_relationship(ecare_conn, cid, hub_cid, "co_documented")
-            if existing:
+            # Check if any relationship already exists between the two
+            pair = frozenset((cid, hub_cid))
+            if pair in existing_pairs:
                 continue
-            # Also check other relationship types
-            any_existing = ecare_conn.execute(
-                """SELECT 1 FROM relationships
-                   WHERE (source_entity_id = ? AND target_entity_id = ?)
-                      OR (source_entity_id = ? AND target_entity_id = ?)
-                   LIMIT 1""",
-                (cid, hub_cid, hub_cid, cid)
-            ).fetchone()
-            if any_existing:
-                continue
-
-            # Search for co-occurrence
-            co_docs = corpus_cooccurrence(corpus_conn, cname, hub_name, has_fts)
-
-            if len(co_docs) >= 3:  # Require 3+ co-occurring documents to reduce noise
-                efta_sample = sorted(co_docs)[:20]
-                rel_id = insert_relationship(
-                    ecare_conn, cid, hub_cid, "co_documented",
-                    weight=len(co_docs),
-                    confidence_score=0.5,
-                    source_documents=efta_sample,
-                    notes=f"Discovered via corpus co-occurrence ({len(co_docs)} shared documents)"
-                )
-                insert_relationship_source(
-                    ecare_conn, rel_id, "corpus",
-                    source_relationship_type="co_occurrence",
-                    source_evidence={
-                        "type": "corpus_discovery",
-                        "document_count": len(co_docs),
-                        "efta_sample": efta_sample,
-                    },
-                    source_confidence=0.5,
-                    evidence_class="corpus_cooccurrence"
-                )
-                new_rels += 1
+            existing_pairs.add(pair)
+            candidates.append((cid, cname, hub_cid, hub_name))
+
+    # Co-occurrence from the step 1 index where both names were searched (or
+    # where one name's own pages already rule the pair out); the rest are
+    # searched on the corpus pool (results in candidate order). Those first go
+    # through a capped search that only answers "3 or more?"; the full document
+    # set (count + sample) is fetched just for the pairs that pass.
+    co_docs_per_pair = [corpus_index.cooccurrence(c[1], c[3], MIN_DISCOVERY_DOCS) if corpus_index else None
+                        for c in candidates]
+    unindexed = [k for k, co_docs in enumerate(co_docs_per_pair) if co_docs is None]
+    gated = corpus_pool.map(
+        pooled_cooccurrence_topk,
+        [candidates[k][1] for k in unindexed], [candidates[k][3] for k in unindexed],
+        [has_fts] * len(unindexed), [MIN_DISCOVERY_DOCS] * len(unindexed),
+    )
+    passed = []
+    for k, co_docs in zip(unindexed, gated):
+        if len(co_docs) >= MIN_DISCOVERY_DOCS:
+            passed.append(k)
+        else:
+            co_docs_per_pair[k] = co_docs
+    searched = corpus_pool.map(
+        pooled_cooccurrence,
+        [candidates[k][1] for k in passed], [candidates[k][3] for k in passed],
+        [has_fts] * len(passed),
+    )
+    for k, co_docs in zip(passed, searched):
+        co_docs_per_pair[k] = co_docs
+
+    for (cid, cname, hub_cid, hub_name), co_docs in zip(candidates, co_docs_per_pair):
+        if len(co_docs) >= MIN_DISCOVERY_DOCS:  # Require 3+ co-occurring documents to reduce noise
+            efta_sample = sorted(co_docs)[:20]
+            rel_id = insert_relationship(
+                ecare_conn, cid, hub_cid, "co_documented",
+                weight=len(co_docs),
+                confidence_score=0.5,
+                source_documents=efta_sample,
+                notes=f"Discovered via corpus co-occurrence ({len(co_docs)} shared documents)"
+            )
+            insert_relationship_source(
+                ecare_conn, rel_id, "corpus",
+                source_relationship_type="co_occurrence",
+                source_evidence={
+                    "type": "corpus_discovery",
+                    "document_count": len(co_docs),
+                    "efta_sample": efta_sample,
+                },
+                source_confidence=0.5,
+                evidence_class="corpus_cooccurrence"
+            )
+            new_rels += 1
 
     ecare_conn.commit()
     elapsed = time.time() - start
@@ -354,7 +700,7 @@ def step3_discover_new_cooccurrences(ecare_conn, corpus_conn, has_fts, top_n_ent
     return new_rels
 
 
-def main(db_path=DEFAULT_DB_PATH, corpus_path=None, top_n=1000):
+def main(db_path=DEFAULT_DB_PATH, corpus_path=None, top_n=1000, conn=None, workers=CORPUS_WORKERS):
     if corpus_path is None:
         corpus_path = CORPUS_DB_PATH
 
@@ -369,16 +715,28 @@ def main(db_path=DEFAULT_DB_PATH, corpus_path=None, top_n=1000):
         print("\nCorpus not available — skipping integration.")
         return
 
-    ecare_conn = get_db_connection(db_path)
+    ecare_conn = conn or get_db_connection(db_path)
+    # Refresh planner statistics now that ingestion + cleanup are done, so the
+    # pair/provenance indexes are picked for lookups here and in later steps
+    ecare_conn.execute("ANALYZE")
+    ecare_conn.commit()
 
     # Step 1: Entity mention counts
-    mention_count = step1_entity_mention_counts(ecare_conn, corpus_conn, has_fts, top_n)
+    mention_count, corpus_index = step1_entity_mention_counts(ecare_conn, corpus_conn, has_fts, top_n)
 
-    # Step 2: Corroborate existing relationships
-    corroborated = step2_relationship_corroboration(ecare_conn, corpus_conn, has_fts, top_n * 3)
-
-    # Step 3: Discover new co-occurrences for under-connected entities
-    new_rels = step3_discover_new_cooccurrences(ecare_conn, corpus_conn, has_fts)
+    corpus_pool, pool_conns = open_corpus_pool(corpus_path, workers)
+    try:
+        # Step 2: Corroborate existing relationships
+        corroborated = step2_relationship_corroboration(ecare_conn, corpus_pool, has_fts, top_n * 3,
+                                                        corpus_path, corpus_index)
+
+        # Step 3: Discover new co-occurrences for under-connected entities
+        new_rels = step3_discover_new_cooccurrences(ecare_conn, corpus_pool, has_fts,
+                                                    corpus_index=corpus_index)
+    finally:
+        corpus_pool.shutdown()
+        for pool_conn in pool_conns:
+            pool_conn.close()
 
     # Summary
     total_sources = ecare_conn.execute(
@@ -404,7 +762,8 @@ def main(db_path=DEFAULT_DB_PATH, corpus_path=None, top_n=1000):
                      started_at=started)
 
     corpus_conn.close()
-    ecare_conn.close()
+    if conn is None:
+        ecare_conn.close()
 
 
 if __name__ == "__main__":
@@ -414,5 +773,7 @@ if __name__ == "__main__":
                         help="Path to full_text_corpus.db")
     parser.add_argument("--top-n", type=int, default=1000,
                         help="Number of top entities to search (default 1000)")
+    parser.add_argument("--workers", type=int, default=CORPUS_WORKERS,
+                        help=f"Threads for corpus co-occurrence queries (default {CORPUS_WORKERS})")
     args = parser.parse_args()
-    main(args.db_path, args.corpus_path, args.top_n)
+    main(args.db_path, args.corpus_path, args.top_n, workers=args.workers)
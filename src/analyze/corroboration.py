@@ -18,20 +18,56 @@ Usage:
 from __future__ import annotations
 
 import csv
-import json
+import functools
 import math
 import os
 import sys
 import argparse
 from collections import Counter, defaultdict
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.utils.common import get_db_connection, now_iso, log_pipeline_run, DEFAULT_DB_PATH
-from src.utils.doc_ids import canonicalize_doc_ref, extract_efta, extract_doj_ogr
+from src.utils.common import (
+    get_db_connection, now_iso, log_pipeline_run, loads_json, load_entity_degrees, DEFAULT_DB_PATH
+)
+from src.utils.doc_ids import canonicalize_doc_refs, parse_raw_id, DOC_REF_RE
 
 OUTPUT_DIR = "data/output"
 
+# Column order for corroboration_rankings.csv; each ranking is a tuple in this order
+RANKING_FIELDS = (
+    "relationship_id", "source_name", "target_name", "relationship_type", "weight",
+    "num_sources", "evidence_points", "num_documents_total",
+    "docs_rhowardstone", "docs_epstein_docs", "docs_doc_explorer", "docs_corpus",
+    "source_systems", "evidence_classes", "corroboration_score",
+)
+# weakly_corroborated.csv adds the more prominent endpoint's connection count
+WEAK_FIELDS = RANKING_FIELDS + ("max_entity_prominence",)
+
+# Rankings are streamed into this temp table (in batches) instead of being held
+# in memory, then read back sorted. seq keeps ties in scoring order, the same
+# as a stable sort would. max_entity_prominence is only set on weak rows.
+RANKINGS_TABLE_SQL = f"""
+    CREATE TEMP TABLE corroboration_rankings (
+        seq INTEGER PRIMARY KEY,
+        {", ".join(WEAK_FIELDS)}
+    )
+"""
+INSERT_RANKING_SQL = (
+    f"INSERT INTO temp.corroboration_rankings ({', '.join(WEAK_FIELDS)}) "
+    f"VALUES ({', '.join('?' * len(WEAK_FIELDS))})"
+)
+RANKINGS_SORTED_SQL = f"""
+    SELECT {", ".join(RANKING_FIELDS)} FROM temp.corroboration_rankings
+    ORDER BY corroboration_score DESC, evidence_points DESC, weight DESC, seq
+"""
+WEAK_SORTED_SQL = f"""
+    SELECT {", ".join(WEAK_FIELDS)} FROM temp.corroboration_rankings
+    WHERE max_entity_prominence IS NOT NULL
+    ORDER BY max_entity_prominence DESC, corroboration_score, seq
+"""
+RANKING_FLUSH_SIZE = 1000
+
 # Evidence class weights. These are deliberately *not* subtle.
 # Co-occurrence is weak. Curated KG edges are strong. RDF is in the middle.
 EVIDENCE_CLASS_WEIGHT = {
@@ -43,82 +79,92 @@ EVIDENCE_CLASS_WEIGHT = {
 }
 
 
+# Evidence class implied by a source system when the row doesn't carry one
+SOURCE_SYSTEM_CLASS = {
+    "rhowardstone": "curated",
+    "doc-explorer": "rdf",
+    "epstein-docs": "cooccurrence",
+    "corpus": "corpus_cooccurrence",
+}
+
+
 def infer_evidence_class(source_system: str, evidence_class: Optional[str]) -> str:
-    if evidence_class:
-        return evidence_class
-    ss = (source_system or "").lower().strip()
-    if ss == "rhowardstone":
-        return "curated"
-    if ss == "doc-explorer":
-        return "rdf"
-    if ss == "epstein-docs":
-        return "cooccurrence"
-    if ss == "corpus":
-        return "corpus_cooccurrence"
-    return "other"
+    return evidence_class or SOURCE_SYSTEM_CLASS.get((source_system or "").lower().strip(), "other")
 
 
 def iter_strings(obj: Any) -> Iterable[str]:
-    """Yield all strings in a nested JSON-ish structure."""
-    if obj is None:
-        return
-    if isinstance(obj, str):
-        yield obj
-    elif isinstance(obj, dict):
-        for v in obj.values():
-            yield from iter_strings(v)
-    elif isinstance(obj, list):
-        for v in obj:
-            yield from iter_strings(v)
-
-
-def extract_doc_keys_from_evidence(conn, source_system: str, evidence: Dict[str, Any]) -> Set[str]:
-    """Best-effort extraction of doc keys from relationship_sources.source_evidence."""
+    """Yield all string leaves in a nested JSON-ish structure (depth-first, in order)."""
+    stack = [obj]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, str):
+            yield v
+        elif isinstance(v, dict):
+            stack.extend(reversed(list(v.values())))
+        elif isinstance(v, list):
+            stack.extend(reversed(v))
+
+
+def extract_doc_keys_from_evidence(conn, source_system: str, evidence: Dict[str, Any],
+                                   written: Optional[Dict[str, tuple]] = None) -> Set[str]:
+    """Best-effort extraction of doc keys from relationship_sources.source_evidence.
+
+    `written` is passed through to canonicalize_doc_refs (see there).
+    """
     keys: Set[str] = set()
     if not evidence:
         return keys
 
     # Explicit lists first
+    listed = []
     for list_field in ("efta_sample", "doc_key_sample", "doc_keys", "documents"):
         v = evidence.get(list_field)
         if isinstance(v, list):
-            for item in v:
-                if not item:
-                    continue
-                tok = canonicalize_doc_ref(conn, str(item), source_system=source_system, confidence=0.6)
-                if tok.doc_key:
-                    keys.add(tok.doc_key)
+            listed.extend(str(item) for item in v if item)
+    found_listed = bool(listed)
 
     # Common scalar fields across sources
     for field in ("document_id", "document_number", "doc_id", "raw_document_id", "raw_id"):
         v = evidence.get(field)
         if v:
-            tok = canonicalize_doc_ref(conn, str(v), source_system=source_system, confidence=0.6)
-            if tok.doc_key:
-                keys.add(tok.doc_key)
+            listed.append(str(v))
+
+    for tok in canonicalize_doc_refs(conn, listed, source_system=source_system, confidence=0.6,
+                                     written=written):
+        if tok.doc_key:
+            keys.add(tok.doc_key)
 
     # rhowardstone stores doc refs in nested metadata sometimes
     meta = evidence.get("metadata")
     if isinstance(meta, dict):
         # Direct key
         if meta.get("efta"):
-            tok = canonicalize_doc_ref(conn, str(meta.get("efta")), source_system=source_system, confidence=0.7)
-            keys.add(tok.doc_key)
-
-    # As a last resort, scan all strings for EFTA/DOJ-OGR tokens
-    for s in iter_strings(evidence):
-        if not s:
-            continue
-        if extract_efta(s) or extract_doj_ogr(s):
-            tok = canonicalize_doc_ref(conn, s, source_system=source_system, confidence=0.4)
-            if tok.doc_key:
+            for tok in canonicalize_doc_refs(conn, [str(meta.get("efta"))], source_system=source_system,
+                                             confidence=0.7, written=written):
                 keys.add(tok.doc_key)
 
+    # As a last resort, scan all strings for EFTA/DOJ-OGR tokens. Not needed
+    # when an explicit document list was present: that already covers it.
+    if found_listed:
+        return keys
+    scanned = [s for s in iter_strings(evidence) if s and DOC_REF_RE.search(s)]
+    for tok in canonicalize_doc_refs(conn, scanned, source_system=source_system, confidence=0.4,
+                                     written=written):
+        if tok.doc_key:
+            keys.add(tok.doc_key)
+
     return keys
 
 
+@functools.lru_cache(maxsize=None)
 def compute_score(num_sources: int, evidence_points: float, num_docs: int) -> float:
-    """Compute corroboration_score in [0, 1]."""
+    """Compute corroboration_score in [0, 1].
+
+    Inputs are small counts and sums of a handful of class weights, so the same
+    combinations come up over and over; results are cached. Stays on math.exp
+    rather than a NumPy pass: with the cache there's little left to vectorise,
+    and np.exp isn't guaranteed to round like math.exp.
+    """
     evidence_strength = 1.0 - math.exp(-0.9 * evidence_points)      # saturates nicely
     doc_strength = 1.0 - math.exp(-0.25 * max(num_docs, 0))         # 1 doc is small, 10 docs is big
     source_strength = 0.0 if num_sources <= 1 else 1.0 - math.exp(-0.8 * (num_sources - 1))
@@ -131,14 +177,18 @@ def compute_score(num_sources: int, evidence_points: float, num_docs: int) -> fl
     return score
 
 
-def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
+def compute_corroboration(db_path: str = DEFAULT_DB_PATH, conn=None):
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Computing corroboration scores (v2)...")
 
-    # Relationships with endpoints
+    # Relationships with endpoints, each with its provenance rows already
+    # grouped by SQLite into a JSON array of {ss, cls, ev} (ev is the raw
+    # source_evidence text)
     rel_rows = conn.execute("""
         SELECT
             r.relationship_id,
@@ -148,39 +198,39 @@ def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
             ce2.canonical_name as target_name,
             r.relationship_type,
             r.weight,
-            r.source_documents
+            r.source_documents,
+            json_group_array(json_object('ss', rs.source_system,
+                                         'cls', rs.evidence_class,
+                                         'ev', rs.source_evidence))
+                FILTER (WHERE rs.id IS NOT NULL) AS sources
         FROM relationships r
         JOIN canonical_entities ce1 ON r.source_entity_id = ce1.canonical_id
         JOIN canonical_entities ce2 ON r.target_entity_id = ce2.canonical_id
+        LEFT JOIN relationship_sources rs ON rs.relationship_id = r.relationship_id
+        GROUP BY r.relationship_id
     """).fetchall()
 
     print(f"  Loaded {len(rel_rows)} relationships")
 
-    # Provenance rows
-    src_rows = conn.execute("""
-        SELECT relationship_id, source_system, evidence_class, source_evidence
-        FROM relationship_sources
-    """).fetchall()
+    # Entity prominence (connection count)
+    prominence: Counter = Counter()
+    for cid, count in load_entity_degrees(conn).items():
+        prominence[str(cid)] += count
 
-    rel_to_sources: Dict[int, List[Tuple[str, Optional[str], Optional[str]]]] = defaultdict(list)
-    for r in src_rows:
-        rel_to_sources[int(r[0])].append((r[1], r[2], r[3]))
+    conn.execute("DROP TABLE IF EXISTS temp.corroboration_rankings")
+    conn.execute(RANKINGS_TABLE_SQL)
+    pending: List[tuple] = []
+    num_rankings = 0
+    num_weak = 0
+    score_dist: Counter = Counter()
 
-    # Entity prominence (connection count)
-    prominence: Dict[str, int] = {}
-    prom_rows = conn.execute("""
-        WITH counts AS (
-            SELECT source_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY source_entity_id
-            UNION ALL
-            SELECT target_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY target_entity_id
-        )
-        SELECT cid, SUM(c) FROM counts GROUP BY cid
-    """).fetchall()
-    for cid, count in prom_rows:
-        prominence[str(cid)] = int(count or 0)
+    # Hoisted out of the per-source loop below
+    class_weight = EVIDENCE_CLASS_WEIGHT.get
+    other_weight = EVIDENCE_CLASS_WEIGHT["other"]
 
-    all_rankings: List[Dict[str, Any]] = []
-    weak: List[Dict[str, Any]] = []
+    # This step is the only document_ids writer while it runs, so repeated refs
+    # (the same documents show up in many evidence payloads) skip their upsert
+    written_doc_ids: Dict[str, tuple] = {}
 
     for row in rel_rows:
         rel_id = int(row[0])
@@ -196,7 +246,7 @@ def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
         docs_json = row[7]
         if docs_json:
             try:
-                loaded = json.loads(docs_json)
+                loaded = loads_json(docs_json)
                 if isinstance(loaded, list):
                     for d in loaded:
                         if d:
@@ -205,7 +255,7 @@ def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
                 pass
 
         # Gather per-source evidence
-        sources = rel_to_sources.get(rel_id, [])
+        sources = [(s["ss"], s["cls"], s["ev"]) for s in loads_json(row[8])]
         source_systems: Set[str] = set()
         evidence_classes: Set[str] = set()
         docs_by_source: Dict[str, Set[str]] = defaultdict(set)
@@ -218,16 +268,16 @@ def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
             evidence_classes.add(cls)
 
             # Source weight: max per source across rows
-            w = EVIDENCE_CLASS_WEIGHT.get(cls, EVIDENCE_CLASS_WEIGHT["other"])
+            w = class_weight(cls, other_weight)
             if ss not in weight_by_source or w > weight_by_source[ss]:
                 weight_by_source[ss] = w
 
             if evidence_json:
                 try:
-                    evidence = json.loads(evidence_json)
+                    evidence = loads_json(evidence_json)
                 except Exception:
                     evidence = {}
-                for dk in extract_doc_keys_from_evidence(conn, ss, evidence):
+                for dk in extract_doc_keys_from_evidence(conn, ss, evidence, written_doc_ids):
                     docs_by_source[ss].add(dk)
                     docs_total.add(dk)
 
@@ -243,67 +293,80 @@ def compute_corroboration(db_path: str = DEFAULT_DB_PATH):
         docs_doc_explorer = len(docs_by_source.get("doc-explorer", set()))
         docs_corpus = len(docs_by_source.get("corpus", set()))
 
-        record = {
-            "relationship_id": rel_id,
-            "source_name": source_name,
-            "target_name": target_name,
-            "relationship_type": rel_type,
-            "weight": round(weight, 3),
-            "num_sources": num_sources,
-            "evidence_points": round(evidence_points, 3),
-            "num_documents_total": num_docs,
-            "docs_rhowardstone": docs_rhowardstone,
-            "docs_epstein_docs": docs_epstein_docs,
-            "docs_doc_explorer": docs_doc_explorer,
-            "docs_corpus": docs_corpus,
-            "source_systems": ",".join(sorted(source_systems)) if source_systems else "unknown",
-            "evidence_classes": ",".join(sorted(evidence_classes)) if evidence_classes else "unknown",
-            "corroboration_score": round(score, 3),
-        }
-        all_rankings.append(record)
+        record = (
+            rel_id,
+            source_name,
+            target_name,
+            rel_type,
+            round(weight, 3),
+            num_sources,
+            round(evidence_points, 3),
+            num_docs,
+            docs_rhowardstone,
+            docs_epstein_docs,
+            docs_doc_explorer,
+            docs_corpus,
+            ",".join(sorted(source_systems)) if source_systems else "unknown",
+            ",".join(sorted(evidence_classes)) if evidence_classes else "unknown",
+            round(score, 3),
+        )
+        num_rankings += 1
+        score_dist[record[-1]] += 1
 
         # Weak relationship flagging:
         # - only 1 source AND not purely epstein-docs co-occurrence
         # - at least one endpoint is moderately prominent
         max_prom = max(prominence.get(src_cid, 0), prominence.get(tgt_cid, 0))
+        weak_prominence = None
         if num_sources == 1 and max_prom >= 20:
             # Identify the single evidence class
             single_cls = next(iter(evidence_classes)) if evidence_classes else "unknown"
             if single_cls != "cooccurrence":
-                weak_record = dict(record)
-                weak_record["max_entity_prominence"] = max_prom
-                weak.append(weak_record)
-
-    # Sort rankings
-    all_rankings.sort(key=lambda x: (-x["corroboration_score"], -x["evidence_points"], -x["weight"]))
-    weak.sort(key=lambda x: (-x.get("max_entity_prominence", 0), x["corroboration_score"]))
+                weak_prominence = max_prom
+                num_weak += 1
+
+        pending.append(record + (weak_prominence,))
+        if len(pending) >= RANKING_FLUSH_SIZE:
+            conn.executemany(INSERT_RANKING_SQL, pending)
+            pending.clear()
+            # Commit the document_ids upserts so far: holding the write lock
+            # for the whole scoring loop would lock out the analysis steps
+            # running alongside this one
+            if conn.in_transaction:
+                conn.commit()
+
+    if pending:
+        conn.executemany(INSERT_RANKING_SQL, pending)
 
     rankings_path = os.path.join(OUTPUT_DIR, "corroboration_rankings.csv")
     with open(rankings_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=list(all_rankings[0].keys()) if all_rankings else [])
-        writer.writeheader()
-        writer.writerows(all_rankings)
+        writer = csv.writer(f)
+        writer.writerow(RANKING_FIELDS)
+        writer.writerows(conn.execute(RANKINGS_SORTED_SQL))
 
     weak_path = os.path.join(OUTPUT_DIR, "weakly_corroborated.csv")
     with open(weak_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=list(weak[0].keys()) if weak else [])
-        writer.writeheader()
-        writer.writerows(weak)
+        writer = csv.writer(f)
+        writer.writerow(WEAK_FIELDS)
+        writer.writerows(conn.execute(WEAK_SORTED_SQL))
+
+    conn.execute("DROP TABLE temp.corroboration_rankings")
+    parse_raw_id.cache_clear()
 
-    score_dist = Counter(r["corroboration_score"] for r in all_rankings)
     print(f"\n  Corroboration score distribution:")
     for score in sorted(score_dist.keys(), reverse=True):
         print(f"    {score}: {score_dist[score]} relationships")
 
-    print(f"\n  Weakly corroborated (single-source, prominent endpoints): {len(weak)}")
+    print(f"\n  Weakly corroborated (single-source, prominent endpoints): {num_weak}")
     print(f"\n  Output: {rankings_path}")
     print(f"  Output: {weak_path}")
 
     log_pipeline_run(conn, "corroboration_scoring_v2", "completed",
-                     records_processed=len(all_rankings),
-                     notes=f"Scored {len(all_rankings)} relationships. {len(weak)} weakly corroborated flagged.",
+                     records_processed=num_rankings,
+                     notes=f"Scored {num_rankings} relationships. {num_weak} weakly corroborated flagged.",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 if __name__ == "__main__":
@@ -22,16 +22,22 @@ Usage:
 """
 
 import csv
+import functools
+import heapq
 import json
 import os
 import sys
 import sqlite3
 import argparse
+import pathlib
+import pickle
+import re
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.utils.common import get_db_connection, now_iso, log_pipeline_run, DEFAULT_DB_PATH
+from src.utils.common import get_db_connection, loads_json, now_iso, log_pipeline_run, DEFAULT_DB_PATH
 from src.utils.doc_ids import lookup_efta_for_doc_key
 
 
@@ -39,6 +45,48 @@ OUTPUT_DIR = "data/output"
 EXTRACTED_ENTITIES_PATH = "data/raw/rhowardstone/extracted_entities_filtered.json"
 CORPUS_DB_PATH = "data/raw/rhowardstone/full_text_corpus.db"
 
+# Parsed extracted-entities lookup, pickled next to the JSON. Bump the version
+# whenever the cached structure changes.
+EXTRACTED_CACHE_SUFFIX = ".pkl"
+EXTRACTED_CACHE_VERSION = 1
+
+# document_coverage.csv columns; coverage rows are tuples in this order
+COVERAGE_FIELDS = (
+    "canonical_id", "canonical_name", "search_term_used",
+    "total_documents_mentioning", "documents_in_knowledge_graph",
+    "coverage_ratio", "unanalyzed_count", "connections",
+)
+
+# Person names too generic to search the corpus for (compared lowercased)
+GENERIC_NAMES = frozenset({"unknown", "john doe", "jane doe"})
+
+# Corpus connection tuning: page cache in KiB (256 MB) and mmap size in bytes
+# (enough for the ~6 GB corpus; SQLite clamps it to its compile-time limit)
+CORPUS_CACHE_KIB = 262144
+CORPUS_MMAP_SIZE = 6 * 1024**3
+
+# Threads counting name variants against the corpus, each on its own read-only
+# connection. SQLite releases the GIL while it runs a statement.
+SEARCH_WORKERS = os.cpu_count() or 1
+
+# Runs of ASCII non-alphanumerics: what the default unicode61 tokenizer splits
+# an all-ASCII string on. Pieces with non-ASCII characters are never checked
+# against the corpus vocabulary.
+ASCII_SEPARATOR_RE = re.compile(r"[^\x80-\U0010ffffA-Za-z0-9]+")
+
+
+def open_corpus_readonly(corpus_path):
+    """Read-only connection to the corpus, usable from any one thread at a time."""
+    uri = pathlib.Path(corpus_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    # The search and vocabulary temp tables stay in RAM instead of temp files.
+    # (Not query_only: that refuses writes to temp tables too.)
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Large page cache, and map the file so FTS5 reads postings without read() copies
+    conn.execute(f"PRAGMA cache_size=-{CORPUS_CACHE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={CORPUS_MMAP_SIZE}")
+    return conn
+
 
 def discover_corpus_schema(corpus_conn):
     """Discover the full-text corpus schema and FTS5 table."""
@@ -55,8 +103,10 @@ def discover_corpus_schema(corpus_conn):
             count = -1
         schema[name] = {"type": ttype, "count": count}
 
-        # Check for FTS5 virtual tables
-        if "fts" in name.lower() or "search" in name.lower():
+        # Check for FTS5 virtual tables. Only tables that actually accept MATCH:
+        # FTS5's own shadow tables (pages_fts_data, pages_fts_idx, ...) match
+        # the name test too and would otherwise win, sorting last.
+        if ("fts" in name.lower() or "search" in name.lower()) and supports_match(corpus_conn, name):
             fts_table = name
 
     # Check if 'pages' is an FTS5 table
@@ -77,14 +127,181 @@ def discover_corpus_schema(corpus_conn):
     return schema, fts_table
 
 
-def search_corpus_fts(corpus_conn, fts_table, search_term):
-    """Search the FTS5 index for a name. Returns count of distinct EFTA documents."""
+def supports_match(corpus_conn, table):
+    """True if `table` is a full-text table (accepts MATCH)."""
+    try:
+        corpus_conn.execute(f"SELECT * FROM [{table}] WHERE [{table}] MATCH 'test' LIMIT 0")
+        return True
+    except Exception:
+        return False
+
+
+def search_corpus_fts_batch(corpus_conn, fts_table, search_terms):
+    """Count distinct EFTA documents for many names in one FTS5 pass.
+
+    The terms go into a temp table and a single join evaluates each one's
+    MATCH, so there's one statement instead of one round-trip per name.
+    Returns dict term -> count; terms with no hits are left out. A term
+    containing a double quote would make the phrase query invalid (and the
+    whole statement fail), so those are skipped — they never matched anyway.
+    """
+    corpus_conn.execute("DROP TABLE IF EXISTS temp.search_terms")
+    corpus_conn.execute("CREATE TEMP TABLE search_terms (term TEXT PRIMARY KEY, query TEXT)")
+    try:
+        corpus_conn.executemany(
+            "INSERT OR IGNORE INTO temp.search_terms (term, query) VALUES (?, ?)",
+            ((term, f'"{term}"') for term in search_terms if '"' not in term)
+        )
+        return dict(corpus_conn.execute(f"""
+            SELECT st.term, COUNT(DISTINCT f.efta_number)
+            FROM temp.search_terms st
+            JOIN [{fts_table}] f ON f.[{fts_table}] MATCH st.query
+            GROUP BY st.term
+        """))
+    finally:
+        corpus_conn.execute("DROP TABLE IF EXISTS temp.search_terms")
+        corpus_conn.commit()
+
+
+def search_corpus_fts_parallel(corpus_path, fts_table, search_terms, workers=SEARCH_WORKERS,
+                               costs=None):
+    """search_corpus_fts_batch with the terms split across worker threads.
+
+    Each worker opens its own read-only connection and runs one batch; the
+    per-term counts are merged (terms are distinct, so nothing overlaps).
+
+    `costs` (term -> estimated work, e.g. from filter_terms_by_vocab) balances
+    the batches: most expensive term first, each onto the least-loaded worker,
+    so one thread doesn't end up with all the common names. Without it the
+    terms are dealt out round-robin.
+    """
+    if costs:
+        loads = [(0, i) for i in range(workers)]
+        chunks = [[] for _ in range(workers)]
+        for term in sorted(search_terms, key=lambda t: -costs.get(t, 1)):
+            load, i = heapq.heappop(loads)
+            chunks[i].append(term)
+            heapq.heappush(loads, (load + costs.get(term, 1), i))
+        chunks = [chunk for chunk in chunks if chunk]
+    else:
+        chunks = [chunk for chunk in (search_terms[i::workers] for i in range(workers)) if chunk]
+
+    def count_chunk(chunk):
+        conn = open_corpus_readonly(corpus_path)
+        try:
+            return search_corpus_fts_batch(conn, fts_table, chunk)
+        finally:
+            conn.close()
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(chunks))) as pool:
+        for part in pool.map(count_chunk, chunks):
+            counts.update(part)
+    return counts
+
+
+def has_default_tokenizer(corpus_conn, fts_table):
+    """True if the FTS5 table tokenizes with plain unicode61 (the default), so
+    an ASCII word maps to its index term by lower-casing alone."""
+    row = corpus_conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = ?", (fts_table,)
+    ).fetchone()
+    sql = (row[0] or "").lower() if row else ""
+    m = re.search(r"tokenize\s*=\s*['\"]?\s*(\w+)", sql)
+    if not m:
+        return True
+    return m.group(1) == "unicode61" and "tokenchars" not in sql and "separators" not in sql
+
+
+def filter_terms_by_vocab(corpus_conn, fts_table, search_terms):
+    """Drop names that can't match because a word in them never occurs in the corpus.
+
+    A phrase query only matches if every one of its tokens is in the index, so
+    each distinct ASCII word is looked up once in an fts5vocab table over the
+    FTS5 index (an equality probe per word, not a scan of the vocabulary) and
+    names with a missing word are left out: their count is 0 without a MATCH.
+
+    Returns dict term -> estimated cost of its phrase query, the number of
+    rows in its words' posting lists (the vocabulary's per-term row counts).
+    Only done for the default tokenizer; otherwise (or if fts5vocab isn't
+    available) every term is kept, at cost 1.
+    """
+    if not has_default_tokenizer(corpus_conn, fts_table):
+        return dict.fromkeys(search_terms, 1)
+
+    words_per_term = {
+        term: {w for w in ASCII_SEPARATOR_RE.split(term.lower()) if w and w.isascii()}
+        for term in search_terms
+    }
+    try:
+        corpus_conn.execute("DROP TABLE IF EXISTS temp.corpus_vocab")
+        corpus_conn.execute(
+            f"CREATE VIRTUAL TABLE temp.corpus_vocab USING fts5vocab(main, [{fts_table}], 'row')"
+        )
+        corpus_conn.execute("DROP TABLE IF EXISTS temp.vocab_probe")
+        corpus_conn.execute("CREATE TEMP TABLE vocab_probe (word TEXT PRIMARY KEY)")
+        corpus_conn.executemany(
+            "INSERT OR IGNORE INTO temp.vocab_probe (word) VALUES (?)",
+            ((w,) for words in words_per_term.values() for w in words)
+        )
+        known = dict(corpus_conn.execute(
+            "SELECT term, doc FROM temp.corpus_vocab WHERE term IN (SELECT word FROM temp.vocab_probe)"
+        ))
+    except sqlite3.OperationalError as e:
+        print(f"  WARNING: corpus vocabulary unavailable ({e}) — searching every name")
+        return dict.fromkeys(search_terms, 1)
+    finally:
+        corpus_conn.execute("DROP TABLE IF EXISTS temp.vocab_probe")
+        corpus_conn.execute("DROP TABLE IF EXISTS temp.corpus_vocab")
+        corpus_conn.commit()
+
+    return {term: max(1, sum(known[w] for w in words))
+            for term, words in words_per_term.items() if words <= known.keys()}
+
+
+def aliases_sql(min_length):
+    """SQL expression flattening canonical_entities.aliases with json_each into
+    a JSON array of its text aliases at least `min_length` characters long.
+    Anything that isn't a valid JSON array counts as no aliases ('[]')."""
+    return f"""
+        (SELECT json_group_array(j.value)
+         FROM json_each(CASE WHEN json_valid(aliases) AND json_type(aliases) = 'array'
+                             THEN aliases END) j
+         WHERE j.type = 'text' AND length(j.value) >= {int(min_length)})"""
+
+
+def person_search_names(cname, search_aliases):
+    """Name variants to search for a person: canonical name + aliases, minus
+    short (under 4 characters) and generic ones.
+
+    `search_aliases` is the JSON array from aliases_sql(4), so the short
+    aliases are already gone.
+    """
+    # Skip names that are too generic or too short
+    return [sname for sname in (cname, *loads_json(search_aliases))
+            if len(sname) >= 4 and sname.lower() not in GENERIC_NAMES]
+
+
+def fts_count_sql(fts_table):
+    """Per-name document count statement for the given FTS5 table.
+
+    The MATCH sits alone in a DISTINCT CTE and the outer query just counts its
+    rows, so the planner keeps the FTS5 index scan (INDEX 0:M...) and only the
+    deduplicated EFTA numbers reach the aggregate.
+    """
+    return (f"WITH m AS (SELECT DISTINCT efta_number FROM [{fts_table}] WHERE [{fts_table}] MATCH ?) "
+            f"SELECT COUNT(*) FROM m")
+
+
+def search_corpus_fts(cursor, count_sql, search_term):
+    """Search the FTS5 index for a name. Returns count of distinct EFTA documents.
+
+    `count_sql` comes from fts_count_sql; callers build it (and the cursor)
+    once per run so every name reuses the same prepared statement.
+    """
     try:
         # FTS5 phrase search with double quotes
-        row = corpus_conn.execute(
-            f'SELECT COUNT(DISTINCT efta_number) FROM [{fts_table}] WHERE [{fts_table}] MATCH ?',
-            (f'"{search_term}"',)
-        ).fetchone()
+        row = cursor.execute(count_sql, (f'"{search_term}"',)).fetchone()
         return row[0] if row else 0
     except Exception:
         return 0
@@ -102,13 +319,66 @@ def search_corpus_like(corpus_conn, search_term):
         return 0
 
 
-def run_with_corpus(db_path, corpus_path):
+def write_coverage_csv(coverage):
+    """Sort coverage rows (tuples in COVERAGE_FIELDS order) by unanalyzed count,
+    descending, and write them out. Returns the output path."""
+    coverage.sort(key=lambda row: -row[COVERAGE_FIELDS.index("unanalyzed_count")])
+
+    output_path = os.path.join(OUTPUT_DIR, "document_coverage.csv")
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COVERAGE_FIELDS)
+        writer.writerows(coverage)
+    return output_path
+
+
+def graph_documents_by_entity(conn):
+    """EFTA numbers referenced by each entity's relationships.
+
+    One pass over relationships (each row counted for both endpoints) instead
+    of a query per entity; source_documents entries are mapped to EFTA via
+    document_ids. Returns dict canonical_id -> set of EFTA numbers.
+    """
+    # The same doc keys turn up on many relationships; document_ids doesn't
+    # change during this step, so each key is looked up once
+    @functools.lru_cache(maxsize=None)
+    def efta_for(doc_key):
+        return lookup_efta_for_doc_key(conn, doc_key)
+
+    # Likewise whole source_documents lists repeat (every relationship
+    # extracted from the same document), so each distinct one is parsed once
+    @functools.lru_cache(maxsize=None)
+    def eftas_for(docs_json):
+        try:
+            doc_list = loads_json(docs_json)
+        except (json.JSONDecodeError, TypeError):
+            return frozenset()
+        if not isinstance(doc_list, list):
+            return frozenset()
+        return frozenset(efta for efta in map(efta_for, map(str, doc_list)) if efta)
+
+    docs_by_entity = defaultdict(set)
+    rows = conn.execute("""
+        SELECT source_entity_id, target_entity_id, source_documents FROM relationships
+        WHERE source_documents IS NOT NULL AND source_documents != ''
+    """)
+    for source_id, target_id, docs_json in rows:
+        eftas = eftas_for(docs_json)
+        if eftas:
+            docs_by_entity[source_id].update(eftas)
+            docs_by_entity[target_id].update(eftas)
+    return docs_by_entity
+
+
+def run_with_corpus(db_path, corpus_path, conn=None):
     """Run document coverage using the full-text corpus FTS5 index."""
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    corpus_conn = sqlite3.connect(corpus_path)
+    corpus_conn = open_corpus_readonly(corpus_path)
     corpus_size = os.path.getsize(corpus_path) / (1024 * 1024 * 1024)
     print(f"Full-text corpus: {corpus_path} ({corpus_size:.1f} GB)")
 
@@ -119,21 +389,20 @@ def run_with_corpus(db_path, corpus_path):
 
     if fts_table:
         print(f"FTS5 table detected: {fts_table}")
-        search_fn = lambda term: search_corpus_fts(corpus_conn, fts_table, term)
     else:
         print("No FTS5 table found — falling back to LIKE search (slower)")
         search_fn = lambda term: search_corpus_like(corpus_conn, term)
 
     # Get persons sorted by connection count (most connected first)
-    persons = conn.execute("""
-        SELECT ce.canonical_id, ce.canonical_name, ce.aliases,
+    persons = conn.execute(f"""
+        SELECT ce.canonical_id, ce.canonical_name, {aliases_sql(4)} AS search_aliases,
                COUNT(DISTINCT r.relationship_id) as rel_count
         FROM canonical_entities ce
         LEFT JOIN relationships r ON r.source_entity_id = ce.canonical_id
                                   OR r.target_entity_id = ce.canonical_id
         WHERE ce.entity_type = 'person'
         GROUP BY ce.canonical_id
-        ORDER BY rel_count DESC
+        ORDER BY rel_count DESC, ce.canonical_id
     """).fetchall()
 
     # Limit to top N persons by connection count to keep runtime reasonable
@@ -145,27 +414,36 @@ def run_with_corpus(db_path, corpus_path):
           f"(of {len(persons)} total, limited to top {MAX_PERSONS} by connection count)...")
 
     coverage = []
+    graph_docs = graph_documents_by_entity(conn)
     search_start = time.time()
     last_report = search_start
 
-    for i, (cid, cname, aliases_json, rel_count) in enumerate(search_persons):
-        # Build search terms: canonical name + aliases
-        search_names = [cname]
-        if aliases_json:
-            try:
-                for alias in json.loads(aliases_json):
-                    if alias and len(alias) > 3:  # Skip very short aliases
-                        search_names.append(alias)
-            except (json.JSONDecodeError, TypeError):
-                pass
-
+    names_per_person = [person_search_names(cname, search_aliases)
+                        for _, cname, search_aliases, _ in search_persons]
+    if fts_table:
+        # Every name variant of every person (each distinct one once), counted
+        # in batched passes spread over the worker threads
+        all_terms = list(dict.fromkeys(sname for names in names_per_person for sname in names))
+        # Names with a word the corpus never contains have no hits; skip their MATCH
+        searchable = filter_terms_by_vocab(corpus_conn, fts_table, all_terms)
+        print(f"  Counting {len(searchable)} distinct name variants "
+              f"({len(all_terms) - len(searchable)} more have a word not in the corpus, "
+              f"{SEARCH_WORKERS} threads)...")
+        try:
+            term_counts = search_corpus_fts_parallel(corpus_path, fts_table, list(searchable),
+                                                     costs=searchable)
+            search_fn = lambda term: term_counts.get(term, 0)
+        except sqlite3.OperationalError as e:
+            print(f"  Batched search failed ({e}) — searching one name at a time")
+            count_sql, cursor = fts_count_sql(fts_table), corpus_conn.cursor()
+            searchable = set(searchable)
+            search_fn = lambda term: search_corpus_fts(cursor, count_sql, term) if term in searchable else 0
+
+    for i, (cid, cname, _, rel_count) in enumerate(search_persons):
         # Search for best match (highest document count across name variants)
         best_count = 0
         best_name = cname
-        for sname in search_names:
-            # Skip names that are too generic or too short
-            if len(sname) < 4 or sname.lower() in ("unknown", "john doe", "jane doe"):
-                continue
+        for sname in names_per_person[i]:
             count = search_fn(sname)
             if count > best_count:
                 best_count = count
@@ -174,40 +452,16 @@ def run_with_corpus(db_path, corpus_path):
         if best_count == 0:
             continue
 
-        # Count documents referenced in this entity's relationships
-        docs_in_graph = conn.execute("""
-            SELECT source_documents FROM relationships
-            WHERE source_entity_id = ? OR target_entity_id = ?
-        """, (cid, cid)).fetchall()
-
-        referenced_docs = set()
-        for row in docs_in_graph:
-            if row[0]:
-                try:
-                    doc_list = json.loads(row[0])
-                    if isinstance(doc_list, list):
-                        for d in doc_list:
-                            efta = lookup_efta_for_doc_key(conn, str(d))
-                            if efta:
-                                referenced_docs.add(efta)
-                except (json.JSONDecodeError, TypeError):
-                    pass
+        # Documents referenced in this entity's relationships
+        referenced_docs = graph_docs.get(cid, ())
 
         total = best_count
         in_graph = len(referenced_docs)
         ratio = in_graph / total if total > 0 else 0
         unanalyzed = total - in_graph
 
-        coverage.append({
-            "canonical_id": cid,
-            "canonical_name": cname,
-            "search_term_used": best_name,
-            "total_documents_mentioning": total,
-            "documents_in_knowledge_graph": in_graph,
-            "coverage_ratio": round(ratio, 4),
-            "unanalyzed_count": max(0, unanalyzed),
-            "connections": rel_count,
-        })
+        coverage.append((cid, cname, best_name, total, in_graph,
+                         round(ratio, 4), max(0, unanalyzed), rel_count))
 
         # Progress reporting
         if time.time() - last_report > 10:
@@ -222,64 +476,78 @@ def run_with_corpus(db_path, corpus_path):
     elapsed = time.time() - search_start
     print(f"  Search complete: {len(coverage)} persons with corpus mentions ({elapsed:.0f}s)")
 
-    # Sort by unanalyzed count descending
-    coverage.sort(key=lambda x: -x["unanalyzed_count"])
-
-    output_path = os.path.join(OUTPUT_DIR, "document_coverage.csv")
-    with open(output_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            "canonical_id", "canonical_name", "search_term_used",
-            "total_documents_mentioning", "documents_in_knowledge_graph",
-            "coverage_ratio", "unanalyzed_count", "connections"
-        ])
-        writer.writeheader()
-        writer.writerows(coverage)
+    output_path = write_coverage_csv(coverage)
 
     print(f"  Output: {output_path} ({len(coverage)} rows)")
 
     if coverage:
         print(f"\n  Top 20 entities by unanalyzed document count:")
-        for c in coverage[:20]:
-            print(f"    {c['canonical_name']}: {c['unanalyzed_count']:,} unanalyzed "
-                  f"({c['documents_in_knowledge_graph']}/{c['total_documents_mentioning']:,} covered, "
-                  f"{c['coverage_ratio']:.1%}) [{c['connections']} connections]")
+        for _, cname, _, total, in_graph, ratio, unanalyzed, connections in coverage[:20]:
+            print(f"    {cname}: {unanalyzed:,} unanalyzed "
+                  f"({in_graph}/{total:,} covered, "
+                  f"{ratio:.1%}) [{connections} connections]")
 
     log_pipeline_run(conn, "document_coverage", "completed",
                      records_processed=len(coverage),
                      notes=f"Full-text corpus mode. {len(coverage)} entities with coverage data. "
                            f"Searched {len(search_persons)} of {len(persons)} persons. "
-                           f"Top gap: {coverage[0]['canonical_name'] if coverage else 'N/A'}",
+                           f"Top gap: {coverage[0][1] if coverage else 'N/A'}",
                      started_at=started)
     corpus_conn.close()
-    conn.close()
+    if owns_conn:
+        conn.close()
+
+
+def load_extracted_names(path):
+    """Name lookup from extracted_entities_filtered.json: lowercased name ->
+    (name, document count), for names mentioned in at least one document.
+
+    The parsed lookup is pickled next to the JSON and reused while it's at
+    least as new as the JSON, so the file is only parsed again when it changes.
+    """
+    cache_path = path + EXTRACTED_CACHE_SUFFIX
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with open(cache_path, "rb") as f:
+                version, name_to_docs = pickle.load(f)
+            if version == EXTRACTED_CACHE_VERSION:
+                return name_to_docs
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(path, "rb") as f:
+        data = loads_json(f.read())
+
+    name_to_docs = {}
+    for entry in data.get("names", []):
+        name = entry.get("entity_value", "")
+        doc_count = entry.get("document_count", 0)
+        if name and doc_count > 0:
+            name_to_docs[name.lower()] = (name, doc_count)
+
+    try:
+        with open(cache_path, "wb") as f:
+            pickle.dump((EXTRACTED_CACHE_VERSION, name_to_docs), f, protocol=5)
+    except OSError as e:
+        print(f"  WARNING: could not write {cache_path}: {e}")
+    return name_to_docs
 
 
-def run_with_extracted_entities(db_path):
+def run_with_extracted_entities(db_path, conn=None):
     """Fallback: run document coverage using extracted_entities_filtered.json."""
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Running document coverage analysis (extracted entities mode)...")
     print("  NOTE: For better results, download the full-text corpus from")
     print("  rhowardstone v3.0 release and pass --corpus-path")
 
-    # Load extracted entities (name -> EFTA document list)
-    name_to_docs = {}
+    # Load extracted entities (lowercased name -> (name, document count))
     if os.path.exists(EXTRACTED_ENTITIES_PATH):
-        with open(EXTRACTED_ENTITIES_PATH, encoding="utf-8") as f:
-            data = json.load(f)
-
-        for entry in data.get("names", []):
-            name = entry.get("entity_value", "")
-            doc_count = entry.get("document_count", 0)
-            efta_list = entry.get("efta_numbers", [])
-            if name and doc_count > 0:
-                name_to_docs[name.lower()] = {
-                    "name": name,
-                    "total_documents": doc_count,
-                    "efta_numbers": set(efta_list),
-                }
+        name_to_docs = load_extracted_names(EXTRACTED_ENTITIES_PATH)
         print(f"  Loaded {len(name_to_docs)} names from extracted_entities_filtered.json")
     else:
         print(f"  WARNING: {EXTRACTED_ENTITIES_PATH} not found")
@@ -288,103 +556,65 @@ def run_with_extracted_entities(db_path):
                          records_processed=0,
                          notes="No data source available (no corpus, no extracted entities)",
                          started_at=started)
-        conn.close()
+        if owns_conn:
+            conn.close()
         return
 
     # For each canonical person, count documents
-    persons = conn.execute("""
-        SELECT canonical_id, canonical_name, aliases FROM canonical_entities
+    persons = conn.execute(f"""
+        SELECT canonical_id, canonical_name, {aliases_sql(1)} FROM canonical_entities
         WHERE entity_type = 'person'
     """).fetchall()
 
     print(f"  Matching {len(persons)} persons against document mentions...")
 
     coverage = []
+    graph_docs = graph_documents_by_entity(conn)
 
-    for cid, cname, aliases_json in persons:
-        search_names = [cname.lower()]
-        if aliases_json:
-            try:
-                for alias in json.loads(aliases_json):
-                    if alias:
-                        search_names.append(alias.lower())
-            except (json.JSONDecodeError, TypeError):
-                pass
+    for cid, cname, search_aliases in persons:
+        search_names = [sname.lower() for sname in (cname, *loads_json(search_aliases))]
 
         best_match = None
         for sname in search_names:
-            if sname in name_to_docs:
-                if best_match is None or name_to_docs[sname]["total_documents"] > best_match["total_documents"]:
-                    best_match = name_to_docs[sname]
+            match = name_to_docs.get(sname)
+            if match is not None and (best_match is None or match[1] > best_match[1]):
+                best_match = match
 
         if not best_match:
             continue
 
-        docs_in_graph = conn.execute("""
-            SELECT source_documents FROM relationships
-            WHERE source_entity_id = ? OR target_entity_id = ?
-        """, (cid, cid)).fetchall()
-
-        referenced_docs = set()
-        for row in docs_in_graph:
-            if row[0]:
-                try:
-                    doc_list = json.loads(row[0])
-                    if isinstance(doc_list, list):
-                        for d in doc_list:
-                            efta = lookup_efta_for_doc_key(conn, str(d))
-                            if efta:
-                                referenced_docs.add(efta)
-                except (json.JSONDecodeError, TypeError):
-                    pass
-
-        total = best_match["total_documents"]
+        referenced_docs = graph_docs.get(cid, ())
+
+        best_name, total = best_match
         in_graph = len(referenced_docs)
         ratio = in_graph / total if total > 0 else 0
         unanalyzed = total - in_graph
 
-        coverage.append({
-            "canonical_id": cid,
-            "canonical_name": cname,
-            "search_term_used": best_match["name"],
-            "total_documents_mentioning": total,
-            "documents_in_knowledge_graph": in_graph,
-            "coverage_ratio": round(ratio, 4),
-            "unanalyzed_count": max(0, unanalyzed),
-            "connections": 0,
-        })
+        coverage.append((cid, cname, best_name, total, in_graph,
+                         round(ratio, 4), max(0, unanalyzed), 0))
 
-    coverage.sort(key=lambda x: -x["unanalyzed_count"])
-
-    output_path = os.path.join(OUTPUT_DIR, "document_coverage.csv")
-    with open(output_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            "canonical_id", "canonical_name", "search_term_used",
-            "total_documents_mentioning", "documents_in_knowledge_graph",
-            "coverage_ratio", "unanalyzed_count", "connections"
-        ])
-        writer.writeheader()
-        writer.writerows(coverage)
+    output_path = write_coverage_csv(coverage)
 
     print(f"\n  Matched {len(coverage)} persons to document mention data")
     print(f"  Output: {output_path}")
 
     if coverage:
         print(f"\n  Top 15 entities by unanalyzed document count:")
-        for c in coverage[:15]:
-            print(f"    {c['canonical_name']}: {c['unanalyzed_count']} unanalyzed "
-                  f"({c['documents_in_knowledge_graph']}/{c['total_documents_mentioning']} covered, "
-                  f"{c['coverage_ratio']:.0%})")
+        for _, cname, _, total, in_graph, ratio, unanalyzed, _ in coverage[:15]:
+            print(f"    {cname}: {unanalyzed} unanalyzed "
+                  f"({in_graph}/{total} covered, "
+                  f"{ratio:.0%})")
 
     log_pipeline_run(conn, "document_coverage", "completed",
                      records_processed=len(coverage),
                      notes=f"Extracted entities mode. {len(coverage)} entities. "
-                           f"Top gap: {coverage[0]['canonical_name'] if coverage else 'N/A'}",
+                           f"Top gap: {coverage[0][1] if coverage else 'N/A'}",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
-def run_document_coverage(db_path: str = DEFAULT_DB_PATH, corpus_path: str = None):
+def run_document_coverage(db_path: str = DEFAULT_DB_PATH, corpus_path: str = None, conn=None):
     """Main entry point. Uses corpus if available, falls back to extracted entities."""
     # Auto-detect corpus
     if corpus_path is None:
@@ -396,13 +626,13 @@ def run_document_coverage(db_path: str = DEFAULT_DB_PATH, corpus_path: str = Non
             print("=" * 60)
             print("ECARE: Document Coverage Analysis (full-text corpus mode)")
             print("=" * 60)
-            run_with_corpus(db_path, corpus_path)
+            run_with_corpus(db_path, corpus_path, conn)
             return
 
     print("=" * 60)
     print("ECARE: Document Coverage Analysis (extracted entities mode)")
     print("=" * 60)
-    run_with_extracted_entities(db_path)
+    run_with_extracted_entities(db_path, conn)
 
 
 if __name__ == "__main__":
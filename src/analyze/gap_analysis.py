@@ -20,12 +20,17 @@ Usage:
 import csv
 import json
 import os
+import re
 import sys
 import argparse
-from collections import defaultdict
+import heapq
+import itertools
+from collections import Counter, defaultdict
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.utils.common import get_db_connection, now_iso, log_pipeline_run, load_excluded_ids, DEFAULT_DB_PATH
+from src.utils.common import (
+    get_db_connection, now_iso, log_pipeline_run, load_excluded_ids, load_entity_degrees, DEFAULT_DB_PATH
+)
 
 OUTPUT_DIR = "data/output"
 
@@ -34,11 +39,12 @@ NOISE_PATTERNS = [
     "unknown person", "unknown company", "author", "narrator",
     "unidentified", "unnamed", "various ", "multiple ",
 ]
+# All of the above as one alternation, so each name is scanned once
+NOISE_RE = re.compile("|".join(re.escape(p) for p in NOISE_PATTERNS))
 
 
 def is_noise_entity(name: str) -> bool:
-    lower = name.lower()
-    return any(p in lower for p in NOISE_PATTERNS)
+    return NOISE_RE.search(name.lower()) is not None
 
 
 def build_graph(conn, min_connections: int = 5):
@@ -48,16 +54,8 @@ def build_graph(conn, min_connections: int = 5):
     print("  Building graph...")
 
     # Find entities with enough connections to be interesting
-    connected = conn.execute("""
-        WITH counts AS (
-            SELECT source_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY source_entity_id
-            UNION ALL
-            SELECT target_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY target_entity_id
-        )
-        SELECT cid, SUM(c) as total FROM counts GROUP BY cid HAVING total >= ?
-    """, (min_connections,)).fetchall()
-
-    interesting_ids = {row[0] for row in connected}
+    interesting_ids = {cid for cid, total in load_entity_degrees(conn).items()
+                       if total >= min_connections}
     print(f"  Entities with {min_connections}+ connections: {len(interesting_ids)}")
 
     # Load exclusion flags (noise entities too entangled to delete)
@@ -74,16 +72,33 @@ def build_graph(conn, min_connections: int = 5):
     interesting_ids = set(id_to_name.keys())
     print(f"  After noise + exclusion filtering: {len(interesting_ids)}")
 
-    # Build graph with only interesting entities
+    # Build graph with only interesting entities. Nodes go in sorted, not in
+    # set order, so degree ties (the top-200 cut) break the same every run
     G = nx.Graph()
-    for cid in interesting_ids:
+    for cid in sorted(interesting_ids):
         G.add_node(cid, name=id_to_name[cid])
 
-    rels = conn.execute("""
-        SELECT source_entity_id, target_entity_id, relationship_type, weight
-        FROM relationships
-        WHERE source_entity_id IN ({ids}) AND target_entity_id IN ({ids})
-    """.format(ids=",".join(f"'{i}'" for i in interesting_ids))).fetchall()
+    # The id set goes in as a temp table (bound parameters) rather than being
+    # pasted into the SQL as literals; the IN subqueries keep the same plan, a
+    # pair-index seek per (source, target) combination. The ORDER BY pins the
+    # pair-index order rows always came back in, so adjacency order (and with
+    # it the shared_neighbors listing) doesn't depend on which index the
+    # planner picks
+    conn.execute("DROP TABLE IF EXISTS temp.interesting")
+    conn.execute("CREATE TEMP TABLE interesting (cid TEXT PRIMARY KEY)")
+    try:
+        conn.executemany("INSERT INTO temp.interesting (cid) VALUES (?)",
+                         ((cid,) for cid in interesting_ids))
+        rels = conn.execute("""
+            SELECT source_entity_id, target_entity_id, relationship_type, weight
+            FROM relationships
+            WHERE source_entity_id IN (SELECT cid FROM temp.interesting)
+              AND target_entity_id IN (SELECT cid FROM temp.interesting)
+            ORDER BY source_entity_id, target_entity_id, relationship_id
+        """).fetchall()
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.interesting")
+        conn.commit()
 
     for src, tgt, rel_type, weight in rels:
         if src in interesting_ids and tgt in interesting_ids:
@@ -98,77 +113,144 @@ def build_graph(conn, min_connections: int = 5):
 
 def common_neighbor_gaps(G, id_to_name, top_n: int = 500):
     """Find unconnected pairs that share many common neighbors."""
-    import networkx as nx
-
     print("\n  Running common neighbor analysis...")
 
     # Only check pairs among the most-connected nodes to keep runtime sane
     degree_sorted = sorted(G.degree(), key=lambda x: x[1], reverse=True)
-    top_nodes = [n for n, d in degree_sorted[:200]]  # top 200 by degree
+    top = degree_sorted[:200]  # top 200 by degree
+    top_nodes = [n for n, d in top]
+    degree = dict(top)
+    index = {n: i for i, n in enumerate(top_nodes)}
+
+    # Shared-neighbor counts, computed from the middle: every node adds one to
+    # each pair of top nodes among its neighbors. That's the A·Aᵀ product over
+    # the top rows with only its non-zero entries ever touched, instead of an
+    # intersection for all ~20k pairs. A dense NumPy product was slower here
+    # once the 200 x N matrix is filled in (the graph is small and sparse),
+    # and a sparse one would need scipy.
+    shared = Counter()
+    for middle in G:
+        tops = sorted(index[n] for n in G[middle] if n in index and n != middle)
+        if len(tops) >= 2:
+            shared.update(itertools.combinations(tops, 2))
+
+    # Score every unconnected pair first; the shared-neighbor lists are only
+    # built for the top_n that make the cut. (i, j) order is the order the
+    # pairs were always checked in, and nlargest keeps ties in input order,
+    # same as the full sort it replaces.
+    candidates = []
+    for (i, j), count in sorted(shared.items()):
+        if count < 3:
+            continue
+        node_a, node_b = top_nodes[i], top_nodes[j]
+        if G.has_edge(node_a, node_b):
+            continue
+        candidates.append((count * (degree[node_a] + degree[node_b]), count, node_a, node_b))
 
     gaps = []
-    checked = 0
-    for i, node_a in enumerate(top_nodes):
-        for node_b in top_nodes[i+1:]:
-            if not G.has_edge(node_a, node_b):
-                common = list(nx.common_neighbors(G, node_a, node_b))
-                if len(common) >= 3:
-                    common_names = [id_to_name.get(c, c) for c in common[:10]]
-                    gaps.append({
-                        "entity_a": id_to_name.get(node_a, node_a),
-                        "entity_b": id_to_name.get(node_b, node_b),
-                        "shared_neighbor_count": len(common),
-                        "shared_neighbors": "; ".join(common_names),
-                        "priority_score": len(common) * (G.degree(node_a) + G.degree(node_b)),
-                    })
-            checked += 1
-
-    gaps.sort(key=lambda x: -x["priority_score"])
+    for score, count, node_a, node_b in heapq.nlargest(top_n, candidates, key=lambda c: c[0]):
+        # Sorted by name before truncating, so the listing doesn't depend on
+        # adjacency or set order (stable across runs and hash seeds)
+        adj_b = G[node_b]
+        common_names = sorted(id_to_name.get(c, c) for c in G[node_a]
+                              if c in adj_b and c != node_a and c != node_b)[:10]
+        gaps.append({
+            "entity_a": id_to_name.get(node_a, node_a),
+            "entity_b": id_to_name.get(node_b, node_b),
+            "shared_neighbor_count": count,
+            "shared_neighbors": "; ".join(common_names),
+            "priority_score": score,
+        })
+
+    checked = len(top_nodes) * (len(top_nodes) - 1) // 2
     print(f"    Pairs checked: {checked}")
-    print(f"    Gaps found (3+ shared neighbors): {len(gaps)}")
-    return gaps[:top_n]
+    print(f"    Gaps found (3+ shared neighbors): {len(candidates)}")
+    return gaps
 
 
-def community_bridge_analysis(G, id_to_name):
-    """Find entities that bridge different network communities."""
+def louvain_partition(G):
+    """Louvain communities as {node: community id}, or None if no backend is installed.
+
+    Uses igraph's multilevel (Louvain) implementation, which is native code,
+    when python-igraph is available; python-louvain (pure Python) otherwise.
+    Both optimise modularity on the "weight" edge attribute, but they don't
+    find the same partition: community ids, community count and so the rows
+    of community_bridges.csv differ between the two backends.
+    """
+    try:
+        import igraph as ig
+    except ImportError:
+        ig = None
+
+    if ig is not None:
+        print("\n  Running community detection (Louvain, igraph)...")
+        nodes = list(G.nodes())
+        index = {n: i for i, n in enumerate(nodes)}
+        edges = list(G.edges(data="weight", default=1))
+        g = ig.Graph(n=len(nodes), edges=[(index[u], index[v]) for u, v, _ in edges])
+        g.es["weight"] = [w for _, _, w in edges]
+        membership = g.community_multilevel(weights="weight").membership
+        return {n: membership[i] for i, n in enumerate(nodes)}
+
     try:
         import community as community_louvain
     except ImportError:
-        print("    WARNING: python-louvain not installed, skipping community analysis")
-        return []
+        return None
+    print("\n  Running community detection (Louvain, python-louvain)...")
+    return community_louvain.best_partition(G)
+
 
-    print("\n  Running community detection (Louvain)...")
-    partition = community_louvain.best_partition(G)
+def community_bridge_analysis(G, id_to_name):
+    """Find entities that bridge different network communities."""
+    partition = louvain_partition(G)
+    if partition is None:
+        print("    WARNING: neither python-igraph nor python-louvain installed, skipping community analysis")
+        return []
 
     num_communities = len(set(partition.values()))
     print(f"    Communities detected: {num_communities}")
 
-    # Find bridge nodes: connected to multiple communities
+    # Find bridge nodes: connected to multiple communities. Every edge is taken
+    # in both directions as a (node, neighbor's community) key; np.unique
+    # leaves the distinct communities per node, sorted by node then community.
+    import numpy as np
+
+    nodes = list(G.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    community = np.fromiter((partition[n] for n in nodes), dtype=np.int64, count=len(nodes))
+    num_keys = int(community.max()) + 1 if len(nodes) else 1
+    ends = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    node_idx = np.concatenate([ends[:, 0], ends[:, 1]])
+    neighbor_idx = np.concatenate([ends[:, 1], ends[:, 0]])
+    keys = np.unique(node_idx * num_keys + community[neighbor_idx])
+    communities_connected = np.bincount(keys // num_keys, minlength=len(nodes))
+    neighbor_communities = np.split(keys % num_keys, np.cumsum(communities_connected)[:-1])
+
+    degree = dict(G.degree())
     bridges = []
-    for node in G.nodes():
-        neighbor_communities = set()
-        for neighbor in G.neighbors(node):
-            neighbor_communities.add(partition.get(neighbor))
-
-        if len(neighbor_communities) >= 2:
-            bridges.append({
-                "entity": id_to_name.get(node, node),
-                "entity_id": node,
-                "home_community": partition.get(node),
-                "communities_connected": len(neighbor_communities),
-                "community_ids": "; ".join(str(c) for c in sorted(neighbor_communities)),
-                "documented_connections": G.degree(node),
-                "bridge_score": len(neighbor_communities) * G.degree(node),
-            })
+    for i in np.flatnonzero(communities_connected >= 2).tolist():
+        node = nodes[i]
+        connected = int(communities_connected[i])
+        bridges.append({
+            "entity": id_to_name.get(node, node),
+            "entity_id": node,
+            "home_community": partition[node],
+            "communities_connected": connected,
+            "community_ids": "; ".join(map(str, neighbor_communities[i].tolist())),
+            "documented_connections": degree[node],
+            "bridge_score": connected * degree[node],
+        })
 
     bridges.sort(key=lambda x: -x["bridge_score"])
     print(f"    Bridge entities (connecting 2+ communities): {len(bridges)}")
     return bridges
 
 
-def run_gap_analysis(db_path: str = DEFAULT_DB_PATH):
+def run_gap_analysis(db_path: str = DEFAULT_DB_PATH, conn=None):
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Running structural gap analysis...")
@@ -215,7 +297,8 @@ def run_gap_analysis(db_path: str = DEFAULT_DB_PATH):
                      records_processed=len(gaps) + len(bridges),
                      notes=f"{len(gaps)} gaps found, {len(bridges)} bridge entities identified.",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 if __name__ == "__main__":
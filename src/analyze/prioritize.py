@@ -21,18 +21,41 @@ Usage:
 """
 
 import csv
+import functools
 import json
+import math
+import operator
 import os
 import sys
 import argparse
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.utils.common import get_db_connection, now_iso, log_pipeline_run, load_excluded_ids, DEFAULT_DB_PATH
+from src.utils.common import (
+    get_db_connection, get_readonly_connection, now_iso, log_pipeline_run, load_excluded_ids,
+    load_entity_degrees, DEFAULT_DB_PATH
+)
 
 OUTPUT_DIR = "data/output"
 
+# Priority points per cross-source contradiction, by severity (anything else: 1)
+CONTRADICTION_BONUS = {"high": 10, "medium": 5, "low": 2}
+
+# Analysis outputs read by the scoring factors: (CSV file, entity column to
+# noise-filter on load). The pair files (weak relationships, gaps) keep every
+# row and check each endpoint, since one noisy endpoint must not drop the
+# other's count.
+FACTOR_INPUTS = [
+    ("document_coverage.csv", "canonical_name"),
+    ("weakly_corroborated.csv", None),
+    ("gap_analysis_common_neighbors.csv", None),
+    ("community_bridges.csv", "entity"),
+    ("cross_source_contradictions.csv", "entity_a"),
+]
+
 # Noise entities to exclude from priority rankings
 NOISE_PATTERNS = [
     "unknown person",
@@ -78,235 +101,291 @@ NOISE_REGEXES = [
     re.compile(r"^(john|jane)\s+doe\s*[#]?\d+\b", re.IGNORECASE),
     re.compile(r"^\(b\)\(\d+\)", re.IGNORECASE),
 ]
+# Names that are exactly one of the patterns (a bare "witness", "redacted",
+# ...) are settled by a hash lookup before the search below
+NOISE_EXACT = frozenset(NOISE_PATTERNS)
+# A name starting with a pattern contains it, so one str.startswith over the
+# tuple settles those without the regex engine
+NOISE_PREFIXES = tuple(NOISE_PATTERNS)
+# Shortest string any pattern or regex can match ("author", "sealed",
+# "(b)(6)"); anything shorter is clean
+MIN_NOISE_LEN = 6
+
+# Substrings and regexes above as one alternation, so a name is checked in a
+# single search instead of a Python-level loop over ~40 patterns. Only the
+# regexes were case-insensitive, so only they get a scoped (?i:...) group.
+NOISE_RE = re.compile(
+    "|".join([re.escape(p) for p in NOISE_PATTERNS] + [f"(?i:{rx.pattern})" for rx in NOISE_REGEXES])
+)
+
+
+# The same names come back from every factor's CSV; pure string check, so cached
+@functools.lru_cache(maxsize=65536)
 def is_noise(name: str) -> bool:
     lower = (name or "").strip().lower()
     if not lower:
         return True
-    if any(p in lower for p in NOISE_PATTERNS):
+    if len(lower) < MIN_NOISE_LEN:
+        return False
+    if lower in NOISE_EXACT or lower.startswith(NOISE_PREFIXES):
         return True
-    return any(rx.search(lower) for rx in NOISE_REGEXES)
+    return NOISE_RE.search(lower) is not None
+
+
+@dataclass(slots=True)
+class EntityScore:
+    """Running research-priority score for one entity, summed over the factors."""
+    canonical_id: str = ""
+    canonical_name: str = ""
+    priority_score: float = 0.0
+    factors: list = field(default_factory=list)
+    prominence: int = 0
 
-def load_csv_data(filename):
-    """Load a CSV from the output directory, returning list of dicts."""
+
+def load_csv_data(filename, name_field=None):
+    """Load a CSV from the output directory, returning list of dicts.
+
+    With name_field, rows whose entity in that column is noise are dropped
+    here, once, so the scoring loops only ever see clean rows.
+    """
     path = os.path.join(OUTPUT_DIR, filename)
     if not os.path.exists(path):
         return []
     with open(path, encoding="utf-8") as f:
-        return list(csv.DictReader(f))
+        reader = csv.DictReader(f)
+        if name_field is None:
+            return list(reader)
+        return [row for row in reader if not is_noise(row.get(name_field, ""))]
 
 
-def run_prioritization(db_path: str = DEFAULT_DB_PATH):
+def run_prioritization(db_path: str = DEFAULT_DB_PATH, conn=None):
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_readonly_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Computing research priorities...")
 
-    # Load all analysis outputs
-    coverage_data = load_csv_data("document_coverage.csv")
-    weak_data = load_csv_data("weakly_corroborated.csv")
-    gaps_data = load_csv_data("gap_analysis_common_neighbors.csv")
-    bridges_data = load_csv_data("community_bridges.csv")
-    contradictions_data = load_csv_data("cross_source_contradictions.csv")
+    # Load all analysis outputs; the files are independent, so they are read
+    # concurrently (file reads release the GIL)
+    with ThreadPoolExecutor(max_workers=len(FACTOR_INPUTS)) as pool:
+        coverage_data, weak_data, gaps_data, bridges_data, contradictions_data = pool.map(
+            lambda spec: load_csv_data(*spec), FACTOR_INPUTS)
 
     print(f"  Loaded: {len(coverage_data)} coverage, {len(weak_data)} weak relationships, "
           f"{len(gaps_data)} gaps, {len(bridges_data)} bridges, {len(contradictions_data)} contradictions")
 
     # Build per-entity scoring
-    scores = defaultdict(lambda: {
-        "canonical_id": "",
-        "canonical_name": "",
-        "priority_score": 0.0,
-        "factors": [],
-        "prominence": 0,
-    })
+    scores = defaultdict(EntityScore)
 
     # Factor 1: Entity prominence (baseline)
     print("  Computing entity prominence...")
-    prom_rows = conn.execute("""
-        WITH counts AS (
-            SELECT source_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY source_entity_id
-            UNION ALL
-            SELECT target_entity_id as cid, COUNT(*) as c FROM relationships GROUP BY target_entity_id
-        )
-        SELECT cid, SUM(c) as total FROM counts GROUP BY cid
-    """).fetchall()
+    # Index-only counts per endpoint column, visited in canonical_id order as
+    # the GROUP BY this replaces returned them (ties in the ranking keep it)
+    prom_rows = sorted((cid, total) for cid, total in load_entity_degrees(conn).items()
+                       if cid is not None)
 
     # Load exclusion flags (noise entities too entangled to delete)
     excluded_ids = load_excluded_ids(conn)
     if excluded_ids:
         print(f"  Entities flagged exclude_from_analysis: {len(excluded_ids)} (will be skipped)")
 
-    id_to_name = {}
-    for row in conn.execute("SELECT canonical_id, canonical_name, entity_type FROM canonical_entities WHERE entity_type = 'person'"):
-        if row[0] not in excluded_ids:
-            id_to_name[row[0]] = row[1]
+    # One cursor for the bulk reads below, returning plain tuples rather than
+    # building a sqlite3.Row per row
+    cur = conn.cursor()
+    cur.row_factory = None
+    # Noise names are dropped inside the entity queries, so those rows never
+    # cross into Python. The (cached) check itself stays in Python: the noise
+    # list is specific to this ranking and kept out of the schema.
+    conn.create_function("is_noise", 1, is_noise, deterministic=True)
+
+    id_to_name = {
+        cid: name
+        for cid, name in cur.execute("""
+            SELECT canonical_id, canonical_name FROM canonical_entities
+            WHERE entity_type = 'person' AND NOT is_noise(canonical_name)
+        """)
+        if cid not in excluded_ids
+    }
 
     for cid, total in prom_rows:
         name = id_to_name.get(cid)
-        if not name or is_noise(name):
+        if not name:
             continue
-        scores[name]["canonical_id"] = cid
-        scores[name]["canonical_name"] = name
-        scores[name]["prominence"] = total
+        entry = scores[name]
+        entry.canonical_id = cid
+        entry.canonical_name = name
+        entry.prominence = total
         # Prominence gives a small baseline score (log-scaled)
-        import math
-        scores[name]["priority_score"] += min(math.log2(total + 1) * 2, 20)
+        entry.priority_score += min(math.log2(total + 1) * 2, 20)
 
     # Factor 2: Document coverage gaps
     print("  Applying document coverage gaps...")
     for row in coverage_data:
         name = row["canonical_name"]
-        if is_noise(name):
-            continue
         unanalyzed = int(row.get("unanalyzed_count", 0))
         if unanalyzed >= 10:
             bonus = min(unanalyzed / 10, 30)  # cap at 30 points
-            scores[name]["priority_score"] += bonus
-            scores[name]["factors"].append(f"document_gap:{unanalyzed}_unanalyzed")
-            if not scores[name]["canonical_id"]:
-                scores[name]["canonical_id"] = row.get("canonical_id", "")
-                scores[name]["canonical_name"] = name
+            entry = scores[name]
+            entry.priority_score += bonus
+            entry.factors.append(f"document_gap:{unanalyzed}_unanalyzed")
+            if not entry.canonical_id:
+                entry.canonical_id = row.get("canonical_id", "")
+                entry.canonical_name = name
 
     # Factor 2b: Corpus mention volume (entities mentioned in many docs
     # but with few graph relationships = under-investigated)
     print("  Applying corpus mention volume...")
-    corpus_rows = conn.execute("""
-        SELECT ce.canonical_id, ce.canonical_name,
-               CAST(json_extract(ce.metadata, '$.corpus_document_count') AS INTEGER) AS doc_count,
-               COUNT(DISTINCT r.relationship_id) AS rel_count
-        FROM canonical_entities ce
-        LEFT JOIN relationships r ON r.source_entity_id = ce.canonical_id
-                                  OR r.target_entity_id = ce.canonical_id
-        WHERE ce.entity_type = 'person'
-          AND json_extract(ce.metadata, '$.corpus_document_count') IS NOT NULL
-        GROUP BY ce.canonical_id
+    corpus_rows = cur.execute("""
+        SELECT canonical_id, canonical_name,
+               CAST(json_extract(metadata, '$.corpus_document_count') AS INTEGER) AS doc_count
+        FROM canonical_entities
+        WHERE entity_type = 'person'
+          AND json_extract(metadata, '$.corpus_document_count') IS NOT NULL
+          AND NOT is_noise(canonical_name)
+        ORDER BY canonical_id
     """).fetchall()
 
+    # Relationships per entity from the prominence counts instead of joining
+    # relationships again. Those count a self-relationship at both ends, so
+    # take the self-relationships back off to count each relationship once.
+    rel_count_by_cid = dict(prom_rows)
+    for cid, loops in cur.execute("""
+        SELECT source_entity_id, COUNT(*) FROM relationships
+        WHERE source_entity_id = target_entity_id
+        GROUP BY source_entity_id
+    """):
+        if cid in rel_count_by_cid:
+            rel_count_by_cid[cid] -= loops
+
     corpus_enriched = 0
-    for cid, name, doc_count, rel_count in corpus_rows:
-        if not doc_count or is_noise(name):
+    for cid, name, doc_count in corpus_rows:
+        if not doc_count:
             continue
+        rel_count = rel_count_by_cid.get(cid, 0)
         # Ratio of document mentions to graph relationships
         # High ratio = mentioned in many docs but few analyzed relationships
         if doc_count > 20 and rel_count < doc_count / 10:
             bonus = min(doc_count / 50, 25)  # cap at 25
-            scores[name]["priority_score"] += bonus
-            scores[name]["factors"].append(f"corpus_mentions:{doc_count}_docs/{rel_count}_rels")
-            if not scores[name]["canonical_id"]:
-                scores[name]["canonical_id"] = cid
-                scores[name]["canonical_name"] = name
+            entry = scores[name]
+            entry.priority_score += bonus
+            entry.factors.append(f"corpus_mentions:{doc_count}_docs/{rel_count}_rels")
+            if not entry.canonical_id:
+                entry.canonical_id = cid
+                entry.canonical_name = name
             corpus_enriched += 1
 
     print(f"    {corpus_enriched} entities scored from corpus mention data")
 
     # Factor 3: Weakly corroborated relationships
     print("  Applying weak corroboration signals...")
-    weak_by_entity = defaultdict(int)
-    for row in weak_data:
-        for name_field in ["source_name", "target_name"]:
-            name = row[name_field]
-            if not is_noise(name):
-                weak_by_entity[name] += 1
+    weak_by_entity = Counter(
+        name for row in weak_data for name in (row["source_name"], row["target_name"])
+        if not is_noise(name)
+    )
 
     for name, count in weak_by_entity.items():
         if count >= 2:
             bonus = min(count * 3, 20)
-            scores[name]["priority_score"] += bonus
-            scores[name]["factors"].append(f"weak_relationships:{count}")
+            entry = scores[name]
+            entry.priority_score += bonus
+            entry.factors.append(f"weak_relationships:{count}")
 
     # Factor 4: Structural gaps (appears in expected-but-missing pairs)
     print("  Applying structural gap signals...")
-    gap_by_entity = defaultdict(int)
-    for row in gaps_data:
-        for name_field in ["entity_a", "entity_b"]:
-            name = row[name_field]
-            if not is_noise(name):
-                gap_by_entity[name] += 1
+    gap_by_entity = Counter(
+        name for row in gaps_data for name in (row["entity_a"], row["entity_b"])
+        if not is_noise(name)
+    )
 
     for name, count in gap_by_entity.items():
         if count >= 1:
             bonus = min(count * 5, 25)
-            scores[name]["priority_score"] += bonus
-            scores[name]["factors"].append(f"structural_gaps:{count}")
+            entry = scores[name]
+            entry.priority_score += bonus
+            entry.factors.append(f"structural_gaps:{count}")
 
     # Factor 5: Community bridges
     print("  Applying community bridge signals...")
     for row in bridges_data:
-        name = row.get("entity", "")
-        if is_noise(name):
-            continue
+        name = row["entity"]
         communities = int(row.get("communities_connected", 0))
         if communities >= 3:
             bonus = min(communities * 3, 15)
-            scores[name]["priority_score"] += bonus
-            scores[name]["factors"].append(f"bridges:{communities}_communities")
+            entry = scores[name]
+            entry.priority_score += bonus
+            entry.factors.append(f"bridges:{communities}_communities")
 
     # Factor 6: Cross-source contradictions
     print("  Applying contradiction signals...")
     for row in contradictions_data:
-        name = row.get("entity_a", "")
-        if is_noise(name):
-            continue
+        name = row["entity_a"]
         severity = row.get("severity", "low")
-        bonus = {"high": 10, "medium": 5, "low": 2}.get(severity, 1)
-        scores[name]["priority_score"] += bonus
-        scores[name]["factors"].append(f"contradiction:{row.get('field', 'unknown')}:{severity}")
+        bonus = CONTRADICTION_BONUS.get(severity, 1)
+        entry = scores[name]
+        entry.priority_score += bonus
+        entry.factors.append(f"contradiction:{row.get('field', 'unknown')}:{severity}")
 
     # Filter and sort
-    ranked = [v for v in scores.values() if v["priority_score"] > 0 and v["canonical_name"]]
-    ranked.sort(key=lambda x: -x["priority_score"])
+    ranked = [v for v in scores.values() if v.priority_score > 0 and v.canonical_name]
+    # reverse=True keeps ties in insertion order, as negating the key did
+    ranked.sort(key=operator.attrgetter("priority_score"), reverse=True)
 
     # Write CSV
     csv_path = os.path.join(OUTPUT_DIR, "research_priorities.csv")
     with open(csv_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            "canonical_id", "canonical_name", "priority_score",
-            "prominence", "contributing_factors"
-        ])
-        writer.writeheader()
-        for r in ranked:
-            writer.writerow({
-                "canonical_id": r["canonical_id"],
-                "canonical_name": r["canonical_name"],
-                "priority_score": round(r["priority_score"], 1),
-                "prominence": r["prominence"],
-                "contributing_factors": "; ".join(r["factors"]) if r["factors"] else "prominence_only",
-            })
-
-    # Write markdown summary
+        writer = csv.writer(f)
+        writer.writerow(["canonical_id", "canonical_name", "priority_score",
+                         "prominence", "contributing_factors"])
+        writer.writerows(
+            (r.canonical_id, r.canonical_name, round(r.priority_score, 1), r.prominence,
+             "; ".join(r.factors) if r.factors else "prominence_only")
+            for r in ranked
+        )
+
+    # Write markdown summary (assembled in memory, written once)
     md_path = os.path.join(OUTPUT_DIR, "research_priorities_summary.md")
-    with open(md_path, "w", encoding="utf-8") as f:
-        f.write("# ECARE Research Priorities\n\n")
-        f.write(f"Generated: {now_iso()}\n\n")
-        f.write("**Disclaimer:** Inclusion in this list does not imply guilt or wrongdoing. ")
-        f.write("Priority scores reflect gaps in available research data, not suspicion. ")
-        f.write("Entities are ranked by the combination of their network prominence, ")
-        f.write("unanalyzed document volume, weakly-sourced relationships, and structural ")
-        f.write("gaps in the knowledge graph.\n\n")
-        f.write("---\n\n")
-        f.write("## Top 50 Research Priorities\n\n")
-        f.write("| Rank | Entity | Score | Prominence | Key Factors |\n")
-        f.write("|------|--------|-------|------------|-------------|\n")
-        for i, r in enumerate(ranked[:50], 1):
-            factors_short = "; ".join(r["factors"][:3]) if r["factors"] else "prominence"
-            f.write(f"| {i} | {r['canonical_name']} | {r['priority_score']:.1f} | "
-                    f"{r['prominence']} | {factors_short} |\n")
-
-        f.write("\n---\n\n## Factor Explanations\n\n")
-        f.write("- **document_gap:N_unanalyzed** — This entity is mentioned in N documents ")
-        f.write("that have not been incorporated into the knowledge graph.\n")
-        f.write("- **corpus_mentions:N_docs/M_rels** — This entity appears in N full-text corpus ")
-        f.write("documents but has only M relationships in the graph, suggesting under-investigation.\n")
-        f.write("- **weak_relationships:N** — This entity has N relationships supported by ")
-        f.write("only a single source with minimal documentation.\n")
-        f.write("- **structural_gaps:N** — This entity appears in N pairs of people who share ")
-        f.write("multiple mutual connections but have no documented direct relationship.\n")
-        f.write("- **bridges:N_communities** — This entity connects N distinct network communities, ")
-        f.write("suggesting they may be an under-investigated intermediary.\n")
-        f.write("- **contradiction:field:severity** — Different sources disagree about this ")
-        f.write("entity's classification or relationships.\n")
-        f.write("- **prominence** — Baseline score from network connectivity.\n")
+    parts = [
+        "# ECARE Research Priorities\n\n",
+        f"Generated: {now_iso()}\n\n",
+        "**Disclaimer:** Inclusion in this list does not imply guilt or wrongdoing. ",
+        "Priority scores reflect gaps in available research data, not suspicion. ",
+        "Entities are ranked by the combination of their network prominence, ",
+        "unanalyzed document volume, weakly-sourced relationships, and structural ",
+        "gaps in the knowledge graph.\n\n",
+        "---\n\n",
+        "## Top 50 Research Priorities\n\n",
+        "| Rank | Entity | Score | Prominence | Key Factors |\n",
+        "|------|--------|-------|------------|-------------|\n",
+    ]
+    for i, r in enumerate(ranked[:50], 1):
+        factors_short = "; ".join(r.factors[:3]) if r.factors else "prominence"
+        parts.append(f"| {i} | {r.canonical_name} | {r.priority_score:.1f} | "
+                     f"{r.prominence} | {factors_short} |\n")
+
+    parts += [
+        "\n---\n\n## Factor Explanations\n\n",
+        "- **document_gap:N_unanalyzed** — This entity is mentioned in N documents ",
+        "that have not been incorporated into the knowledge graph.\n",
+        "- **corpus_mentions:N_docs/M_rels** — This entity appears in N full-text corpus ",
+        "documents but has only M relationships in the graph, suggesting under-investigation.\n",
+        "- **weak_relationships:N** — This entity has N relationships supported by ",
+        "only a single source with minimal documentation.\n",
+        "- **structural_gaps:N** — This entity appears in N pairs of people who share ",
+        "multiple mutual connections but have no documented direct relationship.\n",
+        "- **bridges:N_communities** — This entity connects N distinct network communities, ",
+        "suggesting they may be an under-investigated intermediary.\n",
+        "- **contradiction:field:severity** — Different sources disagree about this ",
+        "entity's classification or relationships.\n",
+        "- **prominence** — Baseline score from network connectivity.\n",
+    ]
+    # Written next to the target and renamed over it, so a crashed run never
+    # leaves a half-written summary behind
+    tmp_path = md_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
+    os.replace(tmp_path, md_path)
 
     print(f"\n  Ranked {len(ranked)} entities")
     print(f"  Output: {csv_path}")
@@ -314,14 +393,19 @@ def run_prioritization(db_path: str = DEFAULT_DB_PATH):
 
     print(f"\n  Top 20 research priorities:")
     for i, r in enumerate(ranked[:20], 1):
-        factors = ", ".join(r["factors"][:2]) if r["factors"] else "prominence"
-        print(f"    {i:2d}. {r['canonical_name']} (score: {r['priority_score']:.1f}) — {factors}")
+        factors = ", ".join(r.factors[:2]) if r.factors else "prominence"
+        print(f"    {i:2d}. {r.canonical_name} (score: {r.priority_score:.1f}) — {factors}")
 
+    if owns_conn:
+        # Everything above only reads; the run log is the one write
+        conn.close()
+        conn = get_db_connection(db_path)
     log_pipeline_run(conn, "research_priorities", "completed",
                      records_processed=len(ranked),
-                     notes=f"Ranked {len(ranked)} entities. Top: {ranked[0]['canonical_name'] if ranked else 'N/A'}",
+                     notes=f"Ranked {len(ranked)} entities. Top: {ranked[0].canonical_name if ranked else 'N/A'}",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 if __name__ == "__main__":
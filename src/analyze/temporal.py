@@ -20,14 +20,19 @@ import os
 import sys
 import sqlite3
 import argparse
+import re
 from collections import Counter, defaultdict
-from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.utils.common import get_db_connection, now_iso, log_pipeline_run, DEFAULT_DB_PATH
+from src.utils.common import (
+    get_db_connection, get_readonly_connection, now_iso, log_pipeline_run, DEFAULT_DB_PATH
+)
 
 OUTPUT_DIR = "data/output"
 
+# Year and optional month at the start of a relationship date
+DATE_PREFIX_RE = re.compile(r"^(\d{4})(?:-(0[1-9]|1[0-2]))?")
+
 # Key dates in the Epstein case for cross-referencing
 KEY_EVENTS = {
     "2005-03": "Palm Beach PD investigation begins",
@@ -54,7 +59,10 @@ def analyze_relationship_dates(conn):
     print("\n  Analyzing relationship dates...")
 
     # Get relationships with date information
-    dated = conn.execute("""
+    # Plain tuples (rows are only indexed), not the connection's sqlite3.Row
+    cur = conn.cursor()
+    cur.row_factory = None
+    dated = cur.execute("""
         SELECT r.relationship_id, ce1.canonical_name, ce2.canonical_name,
                r.relationship_type, r.date_start, r.date_end, r.weight
         FROM relationships r
@@ -76,26 +84,17 @@ def analyze_relationship_dates(conn):
         # Extract year-month for clustering
         date_str = date_start or date_end
         if date_str:
-            try:
-                # Handle various date formats
-                for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
-                    try:
-                        dt = datetime.strptime(date_str[:len(fmt.replace("%", "0"))], fmt)
-                        ym = dt.strftime("%Y-%m")
-                        year_month_counts[ym] += 1
-                        break
-                    except ValueError:
-                        continue
-            except Exception:
-                pass
+            # YYYY-MM-DD, YYYY-MM or YYYY; a bare year counts toward January
+            m = DATE_PREFIX_RE.match(date_str)
+            if m:
+                year_month_counts[f"{m[1]}-{m[2] or '01'}"] += 1
 
         # Check proximity to key events
         nearby_events = []
         if date_str and len(date_str) >= 7:
-            ym = date_str[:7]
-            for event_date, event_desc in KEY_EVENTS.items():
-                if ym == event_date:
-                    nearby_events.append(event_desc)
+            event_desc = KEY_EVENTS.get(date_str[:7])
+            if event_desc:
+                nearby_events.append(event_desc)
 
         timeline.append({
             "source_name": row[1],
@@ -123,44 +122,39 @@ def analyze_doc_explorer_dates(conn):
 
     # Check if documents table has date columns
     try:
-        dates = de_conn.execute("""
-            SELECT date_range_earliest, date_range_latest, category,
-                   one_sentence_summary
+        # Bucketed by year-month in SQLite; dates too short to have a month
+        # land in the NULL bucket, which only counts toward the total
+        buckets = de_conn.execute("""
+            SELECT CASE WHEN length(date_range_earliest) >= 7
+                        THEN substr(date_range_earliest, 1, 7) END AS ym,
+                   COUNT(*)
             FROM documents
             WHERE date_range_earliest IS NOT NULL
-            ORDER BY date_range_earliest
+            GROUP BY ym
         """).fetchall()
-        print(f"    Documents with dates: {len(dates)}")
+        print(f"    Documents with dates: {sum(count for _, count in buckets)}")
 
-        date_clusters = Counter()
-        for row in dates:
-            earliest = row[0]
-            if earliest and len(earliest) >= 7:
-                ym = earliest[:7]
-                date_clusters[ym] += 1
+        date_clusters = Counter({ym: count for ym, count in buckets if ym is not None})
 
         # Find anomalous months (> 2 standard deviations above mean)
         if date_clusters:
-            values = list(date_clusters.values())
-            mean = sum(values) / len(values)
-            variance = sum((v - mean) ** 2 for v in values) / len(values)
-            std = variance ** 0.5
-            threshold = mean + 2 * std
+            import numpy as np
+
+            months = sorted(date_clusters)
+            counts = np.fromiter((date_clusters[ym] for ym in months), dtype=np.int64, count=len(months))
+            mean = float(counts.mean())
+            threshold = mean + 2 * float(counts.std())  # population std, as before
 
             anomalies = []
-            for ym, count in sorted(date_clusters.items()):
-                if count > threshold:
-                    nearby = ""
-                    for event_date, event_desc in KEY_EVENTS.items():
-                        if ym == event_date:
-                            nearby = event_desc
-                    anomalies.append({
-                        "date": ym,
-                        "document_count": count,
-                        "anomaly_type": "high_volume",
-                        "description": f"{count} documents dated this month (avg: {mean:.1f}, threshold: {threshold:.1f})",
-                        "nearby_event": nearby,
-                    })
+            for i in np.flatnonzero(counts > threshold).tolist():
+                ym, count = months[i], int(counts[i])
+                anomalies.append({
+                    "date": ym,
+                    "document_count": count,
+                    "anomaly_type": "high_volume",
+                    "description": f"{count} documents dated this month (avg: {mean:.1f}, threshold: {threshold:.1f})",
+                    "nearby_event": KEY_EVENTS.get(ym, ""),
+                })
 
             print(f"    Anomalous months (>2σ above mean): {len(anomalies)}")
             de_conn.close()
@@ -173,9 +167,11 @@ def analyze_doc_explorer_dates(conn):
     return []
 
 
-def run_temporal_analysis(db_path: str = DEFAULT_DB_PATH):
+def run_temporal_analysis(db_path: str = DEFAULT_DB_PATH, conn=None):
     started = now_iso()
-    conn = get_db_connection(db_path)
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_readonly_connection(db_path)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print("Running temporal analysis...")
@@ -220,11 +216,16 @@ def run_temporal_analysis(db_path: str = DEFAULT_DB_PATH):
     print(f"\n  Date coverage: {dated_rels}/{total_rels} relationships have dates "
           f"({100*dated_rels/total_rels:.1f}%)")
 
+    if owns_conn:
+        # Everything above only reads; the run log is the one write
+        conn.close()
+        conn = get_db_connection(db_path)
     log_pipeline_run(conn, "temporal_analysis", "completed",
                      records_processed=len(timeline),
                      notes=f"{len(timeline)} dated relationships, {len(all_anomalies)} anomalies",
                      started_at=started)
-    conn.close()
+    if owns_conn:
+        conn.close()
 
 
 if __name__ == "__main__":
@@ -11,11 +11,13 @@ Usage:
     python src/ingest/ingest_doc_explorer.py [--db-path data/output/ecare.db]
 """
 
+import functools
 import json
 import os
 import sys
 import sqlite3
 import argparse
+from array import array
 from collections import Counter, defaultdict
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -29,12 +31,68 @@ from src.utils.common import (
     DEFAULT_DB_PATH
 )
 from src.resolve.resolve_persons import EntityResolver, is_redaction_marker, is_noise_entity_name
-from src.utils.doc_ids import canonicalize_doc_ref
+from src.utils.doc_ids import canonicalize_doc_refs
 
 
 RAW_DIR = "data/raw/doc-explorer"
 SOURCE_DB = "document_analysis.db"
 
+# Per-name verdicts for RDF triple actors/targets (see ingest_rdf_triples)
+NAME_OK = 0
+NAME_NOISE = 1          # redaction marker or noise as written
+NAME_ALIAS_NOISE = 2    # noise once mapped through entity_aliases
+NAME_EMPTY = 3          # empty value: the triple is dropped uncounted
+
+# RDF action text -> relationship type; the first pattern (in this order)
+# found in the action wins, anything else is associated_with
+ACTION_MAP = {
+    "traveled with": "traveled_with",
+    "flew with": "traveled_with",
+    "associated with": "associated_with",
+    "met with": "associated_with",
+    "employed": "employed_by",
+    "hired": "employed_by",
+    "paid": "financial",
+    "funded": "financial",
+    "donated to": "financial",
+    "communicated with": "communicated_with",
+    "called": "communicated_with",
+    "emailed": "communicated_with",
+    "represented": "represented_by",
+}
+# Small integer per relationship type, packed into the RDF pair keys
+RELATIONSHIP_TYPE_IDS = {
+    rel_type: i for i, rel_type in enumerate(dict.fromkeys(["associated_with", *ACTION_MAP.values()]))
+}
+
+# Statements run once per triple / per relationship during RDF ingestion. Kept
+# as constants and run through one cursor so each is prepared once and then
+# served from the connection's statement cache.
+WEIGHT_INCREMENT_SQL = "UPDATE relationships SET weight = COALESCE(weight, 0) + ? WHERE relationship_id = ?"
+SOURCE_EXISTS_SQL = (
+    "SELECT 1 FROM relationship_sources WHERE relationship_id = ? AND source_system = 'doc-explorer' LIMIT 1"
+)
+GET_EVIDENCE_SQL = (
+    "SELECT source_evidence FROM relationship_sources WHERE relationship_id = ? "
+    "AND source_system = 'doc-explorer' ORDER BY id DESC LIMIT 1"
+)
+UPDATE_EVIDENCE_SQL = (
+    "UPDATE relationship_sources SET source_evidence = ? WHERE relationship_id = ? AND source_system = 'doc-explorer'"
+)
+
+
+@functools.lru_cache(maxsize=65536)
+def relationship_type_for_action(action_lower: str) -> str:
+    """Map a lowercased RDF action to a relationship type (see ACTION_MAP).
+
+    Action phrases repeat heavily across triples, so each distinct one is
+    scanned once and then answered from the cache.
+    """
+    for pattern, mapped_type in ACTION_MAP.items():
+        if pattern in action_lower:
+            return mapped_type
+    return "associated_with"
+
 
 def check_source_db(raw_dir: str) -> str:
     """Verify the source database exists and is not an LFS pointer."""
@@ -89,9 +147,9 @@ def ingest_entity_aliases(ecare_conn, source_conn, schema: dict) -> dict:
         FROM entity_aliases
         WHERE canonical_name IS NOT NULL
         ORDER BY canonical_name
-    """).fetchall()
+    """)
 
-    # Group by canonical name
+    # Group by canonical name (streamed off the cursor)
     canonical_data = defaultdict(lambda: {"variants": set(), "hop_distance": None})
     for canonical_name, original_name, hop_dist in rows:
         canonical_data[canonical_name]["variants"].add(original_name)
@@ -104,6 +162,8 @@ def ingest_entity_aliases(ecare_conn, source_conn, schema: dict) -> dict:
     registry = load_canonical_registry(ecare_conn)
     # Match against persons (most doc-explorer entities are persons)
     resolver = EntityResolver(registry, fuzzy_threshold=90)
+    # Batch the fuzzy scoring for every name up front (see prime_fuzzy)
+    resolver.prime_fuzzy(list(canonical_data))
 
     de_name_to_cid = {}
     stats = Counter()
@@ -133,19 +193,25 @@ def ingest_entity_aliases(ecare_conn, source_conn, schema: dict) -> dict:
                     (json.dumps(merged), now_iso(), cid)
                 )
 
-            # Add hop distance to metadata if available
+            # Add hop distance to metadata if available. The key check runs in
+            # SQL (json_type is NULL for a missing path but 'null' for an
+            # explicit null), so only rows that gain the key come back to
+            # Python; the write stays json.dumps like every other metadata blob
             if data["hop_distance"] is not None:
                 row = ecare_conn.execute(
-                    "SELECT metadata FROM canonical_entities WHERE canonical_id = ?", (cid,)
+                    """SELECT metadata FROM canonical_entities
+                       WHERE canonical_id = ?
+                         AND json_type(COALESCE(NULLIF(metadata, ''), '{}'),
+                                       '$.hop_distance_from_epstein') IS NULL""",
+                    (cid,)
                 ).fetchone()
                 if row:
                     meta = json.loads(row[0]) if row[0] else {}
-                    if "hop_distance_from_epstein" not in meta:
-                        meta["hop_distance_from_epstein"] = data["hop_distance"]
-                        ecare_conn.execute(
-                            "UPDATE canonical_entities SET metadata = ? WHERE canonical_id = ?",
-                            (json.dumps(meta), cid)
-                        )
+                    meta["hop_distance_from_epstein"] = data["hop_distance"]
+                    ecare_conn.execute(
+                        "UPDATE canonical_entities SET metadata = ? WHERE canonical_id = ?",
+                        (json.dumps(meta), cid)
+                    )
 
             insert_resolution_log(
                 ecare_conn, "doc-explorer", f"alias:{de_canonical}", de_canonical,
@@ -210,130 +276,172 @@ def ingest_rdf_triples(ecare_conn, source_conn, schema: dict, name_to_cid: dict)
     actor_col = "actor" if "actor" in cols else "subject"
     target_col = "target" if "target" in cols else "object"
 
-    rows = source_conn.execute(f"""
-        SELECT {actor_col}, action, {target_col}, doc_id
-        FROM rdf_triples
-        WHERE {actor_col} IS NOT NULL AND {target_col} IS NOT NULL
-    """).fetchall()
-
-    print(f"    Triples with both actor and target: {len(rows)}")
+    # Noise / alias / resolution checks depend only on the name, so run them
+    # once per distinct actor or target and let SQLite join the verdicts back
+    # onto the triples: only resolvable triples come back into Python.
+    names = source_conn.execute(f"""
+        SELECT {actor_col} FROM rdf_triples WHERE {actor_col} IS NOT NULL
+        UNION
+        SELECT {target_col} FROM rdf_triples WHERE {target_col} IS NOT NULL
+    """)
+    verdicts = []
+    pending = []  # (raw, stripped name) still to be checked through the aliases
+    for (raw,) in names:
+        if not raw:
+            verdicts.append((raw, NAME_EMPTY, None))
+            continue
+        name = str(raw).strip()
+        if is_redaction_marker(name) or is_noise_entity_name(name):
+            verdicts.append((raw, NAME_NOISE, None))
+            continue
+        pending.append((raw, name))
 
-    # Load entity alias mapping
+    # Entity alias mapping, only for the names the triples actually use; the
+    # scan keeps table order, so a repeated original_name still maps to its
+    # last row
     alias_map = {}
     if "entity_aliases" in schema:
-        alias_rows = source_conn.execute(
-            "SELECT original_name, canonical_name FROM entity_aliases"
-        ).fetchall()
-        alias_map = {orig: canon for orig, canon in alias_rows}
+        source_conn.execute("DROP TABLE IF EXISTS temp.alias_lookup")
+        source_conn.execute("CREATE TEMP TABLE alias_lookup (name TEXT PRIMARY KEY)")
+        source_conn.executemany("INSERT OR IGNORE INTO temp.alias_lookup VALUES (?)",
+                                ((name,) for _, name in pending))
+        alias_map = {
+            orig: canon
+            for orig, canon in source_conn.execute("""
+                SELECT original_name, canonical_name FROM entity_aliases
+                WHERE original_name IN (SELECT name FROM temp.alias_lookup)
+            """)
+        }
+        source_conn.execute("DROP TABLE temp.alias_lookup")
+
+    for raw, name in pending:
+        canonical = alias_map.get(name, name)
+        if is_noise_entity_name(canonical):
+            verdicts.append((raw, NAME_ALIAS_NOISE, None))
+            continue
+        verdicts.append((raw, NAME_OK, name_to_cid.get(canonical) or None))
+
+    # Dense number per resolved canonical id, assigned in canonical_id order so
+    # that comparing numbers orders a pair the same way as comparing the ids
+    cid_by_num = sorted({cid for _, _, cid in verdicts if cid})
+    num_by_cid = {cid: num for num, cid in enumerate(cid_by_num)}
+    verdicts = [(raw, status, cid, num_by_cid.get(cid)) for raw, status, cid in verdicts]
+
+    source_conn.execute("DROP TABLE IF EXISTS temp.triple_names")
+    source_conn.execute(
+        "CREATE TEMP TABLE triple_names (raw PRIMARY KEY, status INTEGER, cid TEXT, cid_num INTEGER)")
+    source_conn.executemany("INSERT OR IGNORE INTO temp.triple_names VALUES (?, ?, ?, ?)", verdicts)
+
+    # CROSS JOIN keeps rdf_triples as the outer loop, so triples come back in
+    # table order as the plain scan returned them
+    triple_join = f"""
+        FROM rdf_triples t
+        CROSS JOIN temp.triple_names a ON a.raw = t.{actor_col}
+        CROSS JOIN temp.triple_names b ON b.raw = t.{target_col}
+    """
+    # Same precedence as the per-triple checks this replaces; NULL = skipped
+    # without being counted (empty actor or target)
+    skip_counts = source_conn.execute(f"""
+        SELECT CASE
+                 WHEN a.status = {NAME_EMPTY} OR b.status = {NAME_EMPTY} THEN NULL
+                 WHEN a.status = {NAME_NOISE} THEN 'skipped_actor_noise'
+                 WHEN b.status = {NAME_NOISE} THEN 'skipped_target_noise'
+                 WHEN a.status = {NAME_ALIAS_NOISE} OR b.status = {NAME_ALIAS_NOISE} THEN 'skipped_alias_noise'
+                 WHEN a.cid IS NULL OR b.cid IS NULL OR a.cid = b.cid THEN 'skipped_unresolved'
+                 ELSE 'kept'
+               END AS outcome, COUNT(*)
+        {triple_join}
+        GROUP BY outcome
+    """).fetchall()
 
-    stats = Counter()
-    pair_action_count = Counter()
+    print(f"    Triples with both actor and target: {sum(count for _, count in skip_counts)}")
 
-    # Aggregate evidence per relationship
-    pairkey_to_relid = {}
-    rel_docs = defaultdict(set)      # rel_id -> set(doc_key)
-    rel_actions = defaultdict(Counter)  # rel_id -> Counter(action)
-
-    ACTION_MAP = {
-        "traveled with": "traveled_with",
-        "flew with": "traveled_with",
-        "associated with": "associated_with",
-        "met with": "associated_with",
-        "employed": "employed_by",
-        "hired": "employed_by",
-        "paid": "financial",
-        "funded": "financial",
-        "donated to": "financial",
-        "communicated with": "communicated_with",
-        "called": "communicated_with",
-        "emailed": "communicated_with",
-        "represented": "represented_by",
-    }
-
-    for actor, action, target, doc_id in rows:
-        if not actor or not target:
-            continue
+    # Iterated straight off the cursor below rather than materialized: the
+    # source connection isn't touched again until the loop is done
+    rows = source_conn.execute(f"""
+        SELECT a.cid_num, b.cid_num, t.{actor_col}, t.action, t.{target_col}, t.doc_id
+        {triple_join}
+        WHERE a.status = {NAME_OK} AND b.status = {NAME_OK}
+          AND a.cid IS NOT NULL AND b.cid IS NOT NULL AND a.cid <> b.cid
+    """)
+
+    stats = Counter({outcome: count for outcome, count in skip_counts
+                     if outcome and outcome != "kept"})
+
+    # Per (pair, relationship type), by a dense index assigned on first sight:
+    # triple count, the first triple, and the docs / actions seen
+    pair_index = {}
+    pair_counts = array("q")
+    pair_first = []     # (pair, rel_type, actor, action, target, doc_key)
+    pair_docs = []      # set(doc_key)
+    pair_actions = []   # Counter(action)
+    written_doc_ids = {}                # doc_key -> last document_ids upsert
 
+    # Aggregate evidence per relationship
+    rel_docs = {}                       # rel_id -> set(doc_key)
+    rel_actions = {}                    # rel_id -> Counter(action)
+    rel_weight_delta = {}               # rel_id -> repeat triples to add to weight
+
+    # The triple pass and the evidence roll-up below write as one transaction,
+    # taking the write lock up front instead of at the first upsert
+    if ecare_conn.in_transaction:
+        ecare_conn.commit()
+    ecare_conn.execute("BEGIN IMMEDIATE")
+    cur = ecare_conn.cursor()
+
+    # Pass 1: fold the triples into per-pair aggregates. Only the doc id
+    # canonicalization touches the database here.
+    for actor_num, target_num, actor, action, target, doc_id in rows:
         actor = str(actor).strip()
         target = str(target).strip()
         action = str(action or "").strip()
         doc_id = str(doc_id or "").strip()
 
-        if is_redaction_marker(actor) or is_noise_entity_name(actor):
-            stats["skipped_actor_noise"] += 1
-            continue
-        if is_redaction_marker(target) or is_noise_entity_name(target):
-            stats["skipped_target_noise"] += 1
-            continue
-
-        actor_canonical = alias_map.get(actor, actor)
-        target_canonical = alias_map.get(target, target)
-
-        if is_noise_entity_name(actor_canonical) or is_noise_entity_name(target_canonical):
-            stats["skipped_alias_noise"] += 1
-            continue
-
-        actor_cid = name_to_cid.get(actor_canonical)
-        target_cid = name_to_cid.get(target_canonical)
-
-        if not actor_cid or not target_cid or actor_cid == target_cid:
-            stats["skipped_unresolved"] += 1
-            continue
-
         action_lower = action.lower()
-        rel_type = "associated_with"
-        for pattern, mapped_type in ACTION_MAP.items():
-            if pattern in action_lower:
-                rel_type = mapped_type
-                break
+        rel_type = relationship_type_for_action(action_lower)
 
-        pair = tuple(sorted([actor_cid, target_cid]))
-        pair_key = (pair, rel_type)
-        pair_action_count[pair_key] += 1
+        lo, hi = (actor_num, target_num) if actor_num < target_num else (target_num, actor_num)
+        # (pair, type) packed into one int: no tuples built, cheap to hash
+        pair_key = (lo << 32 | hi) << 4 | RELATIONSHIP_TYPE_IDS[rel_type]
 
-        tok = canonicalize_doc_ref(
+        # Doc ids repeat heavily across triples: an upsert identical to the
+        # last one written for its doc_key is skipped (see canonicalize_doc_refs)
+        doc_key = canonicalize_doc_refs(
             ecare_conn,
-            doc_id,
+            [doc_id],
             source_system="doc-explorer",
             confidence=0.6,
-            notes="rdf_triples"
-        )
-        doc_key = tok.doc_key
-
-        rel_id = None
-
-        if pair_action_count[pair_key] == 1:
-            existing = find_existing_relationship(ecare_conn, pair[0], pair[1], rel_type)
-
-            if existing:
-                rel_id = int(existing)
-
-                already = ecare_conn.execute(
-                    "SELECT 1 FROM relationship_sources WHERE relationship_id = ? AND source_system = 'doc-explorer' LIMIT 1",
-                    (rel_id,)
-                ).fetchone()
-                if not already:
-                    insert_relationship_source(
-                        ecare_conn, rel_id, "doc-explorer",
-                        source_relationship_type=action,
-                        source_evidence={
-                            "type": "rdf_triple",
-                            "document_count": 0,
-                            "doc_key_sample": [],
-                            "action_counts": {}
-                        },
-                        source_confidence=0.7,
-                        evidence_class="rdf"
-                    )
-                stats["existing_corroborated"] += 1
-            else:
-                rel_id = insert_relationship(
-                    ecare_conn, pair[0], pair[1], rel_type,
-                    relationship_subtype=action,
-                    weight=1.0, confidence_score=0.7,
-                    source_documents=[doc_key] if doc_key else None,
-                    notes=f"From RDF triple: {actor} → {action} → {target}"
-                )
+            notes="rdf_triples",
+            written=written_doc_ids,
+        )[0].doc_key
+
+        idx = pair_index.get(pair_key)
+        if idx is None:
+            idx = pair_index[pair_key] = len(pair_counts)
+            pair_counts.append(0)
+            pair_first.append(((cid_by_num[lo], cid_by_num[hi]), rel_type, actor, action, target, doc_key))
+            pair_docs.append(set())
+            pair_actions.append(Counter())
+        pair_counts[idx] += 1
+        if doc_key:
+            pair_docs[idx].add(doc_key)
+        if action_lower:
+            pair_actions[idx][action_lower] += 1
+
+    if pair_counts:
+        stats["triples_processed"] = sum(pair_counts)
+
+    # Pass 2: one relationship per pair, in first-seen order. Each pair maps
+    # to its own relationship, so nothing here depends on the triple order
+    # beyond the first triple kept above.
+    for idx, (pair, rel_type, actor, action, target, doc_key) in enumerate(pair_first):
+        existing = find_existing_relationship(ecare_conn, pair[0], pair[1], rel_type)
+
+        if existing:
+            rel_id = int(existing)
+
+            already = cur.execute(SOURCE_EXISTS_SQL, (rel_id,)).fetchone()
+            if not already:
                 insert_relationship_source(
                     ecare_conn, rel_id, "doc-explorer",
                     source_relationship_type=action,
@@ -346,39 +454,54 @@ def ingest_rdf_triples(ecare_conn, source_conn, schema: dict, name_to_cid: dict)
                     source_confidence=0.7,
                     evidence_class="rdf"
                 )
-                stats["new_relationships"] += 1
-
-            pairkey_to_relid[pair_key] = rel_id
-
+            stats["existing_corroborated"] += 1
         else:
-            rel_id = pairkey_to_relid.get(pair_key)
-            # Increment weight for a few repeat triples (avoid huge inflation)
-            if rel_id and pair_action_count[pair_key] <= 5:
-                ecare_conn.execute(
-                    "UPDATE relationships SET weight = COALESCE(weight, 0) + 1 WHERE relationship_id = ?",
-                    (rel_id,)
-                )
-                stats["relationships_incremented"] += 1
-
-        if rel_id:
-            if doc_key:
-                rel_docs[rel_id].add(doc_key)
-                append_relationship_documents(ecare_conn, rel_id, [doc_key])
-            if action_lower:
-                rel_actions[rel_id][action_lower] += 1
-
-        stats["triples_processed"] += 1
+            rel_id = insert_relationship(
+                ecare_conn, pair[0], pair[1], rel_type,
+                relationship_subtype=action,
+                weight=1.0, confidence_score=0.7,
+                source_documents=[doc_key] if doc_key else None,
+                notes=f"From RDF triple: {actor} → {action} → {target}"
+            )
+            insert_relationship_source(
+                ecare_conn, rel_id, "doc-explorer",
+                source_relationship_type=action,
+                source_evidence={
+                    "type": "rdf_triple",
+                    "document_count": 0,
+                    "doc_key_sample": [],
+                    "action_counts": {}
+                },
+                source_confidence=0.7,
+                evidence_class="rdf"
+            )
+            stats["new_relationships"] += 1
 
-    ecare_conn.commit()
+        if not rel_id:
+            continue
+        # Weight goes up for a few repeat triples (avoid huge inflation)
+        repeats = min(pair_counts[idx], 5) - 1
+        if repeats:
+            rel_weight_delta[rel_id] = repeats
+            stats["relationships_incremented"] += repeats
+        if pair_docs[idx]:
+            rel_docs[rel_id] = pair_docs[idx]
+        if pair_actions[idx]:
+            rel_actions[rel_id] = pair_actions[idx]
+
+    source_conn.execute("DROP TABLE temp.triple_names")
+
+    # Weight and source_documents are applied once per relationship here
+    # rather than once per triple
+    cur.executemany(WEIGHT_INCREMENT_SQL, ((delta, rel_id) for rel_id, delta in rel_weight_delta.items()))
+    for rel_id, docs in rel_docs.items():
+        append_relationship_documents(ecare_conn, rel_id, sorted(docs))
 
     # Update relationship_sources evidence with aggregated counts + samples
     updated = 0
     for rel_id, docs in rel_docs.items():
         docs = {d for d in docs if d}
-        row = ecare_conn.execute(
-            "SELECT source_evidence FROM relationship_sources WHERE relationship_id = ? AND source_system = 'doc-explorer' ORDER BY id DESC LIMIT 1",
-            (rel_id,)
-        ).fetchone()
+        row = cur.execute(GET_EVIDENCE_SQL, (rel_id,)).fetchone()
         if not row:
             continue
         try:
@@ -394,10 +517,7 @@ def ingest_rdf_triples(ecare_conn, source_conn, schema: dict, name_to_cid: dict)
         if ac:
             ev["action_counts"] = dict(ac.most_common(20))
 
-        ecare_conn.execute(
-            "UPDATE relationship_sources SET source_evidence = ? WHERE relationship_id = ? AND source_system = 'doc-explorer'",
-            (json.dumps(ev), rel_id)
-        )
+        cur.execute(UPDATE_EVIDENCE_SQL, (json.dumps(ev), rel_id))
         updated += 1
 
     ecare_conn.commit()
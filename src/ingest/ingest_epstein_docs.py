@@ -62,6 +62,8 @@ def ingest_dedupe_entities(conn, raw_dir: str, entity_type_key: str,
     type_registry = {k: v for k, v in registry.items()
                      if v["entity_type"] == canonical_entity_type}
     resolver = EntityResolver(type_registry, fuzzy_threshold=90)
+    # Batch the fuzzy scoring for every name up front (see prime_fuzzy)
+    resolver.prime_fuzzy(sorted(canonical_names))
 
     # Also build a mapping of variant -> canonical for alias enrichment
     name_to_variants = defaultdict(set)
@@ -131,6 +131,8 @@ def ingest_knowledge_graph_entities(conn, raw_dir: str, slug_to_cid: dict) -> di
             "metadata": json.loads(row[3]) if row[3] else {},
         }
     resolver = EntityResolver(registry, fuzzy_threshold=90)
+    # Batch the fuzzy scoring for every person name up front (see prime_fuzzy)
+    resolver.prime_fuzzy([e["name"] for e in entities if e.get("entity_type", "person") == "person"])
 
     kg_id_to_cid = {}
     stats = Counter()
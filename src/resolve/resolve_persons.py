@@ -18,7 +18,9 @@ Design decisions:
       catch errors downstream.
 """
 
+import math
 import re
+import sys
 from rapidfuzz import fuzz, process
 from typing import Optional, Tuple, List
 
@@ -28,6 +30,12 @@ from typing import Optional, Tuple, List
 NUMBERED_PATTERN = re.compile(r'(?:Jane|John)\s+Doe\s*[#]?\d|Employee[- ]?\d|Detective\s*\d|Victim\s*[#]?\d', re.IGNORECASE)
 
 
+# Names scored per rapidfuzz.process.cdist call in EntityResolver.prime_fuzzy.
+# Chunks are length-sorted, so smaller chunks mean narrower length bands
+# (and a score matrix of at most this many rows x registry size).
+FUZZY_PRIME_CHUNK = 64
+
+
 # Very common non-entity strings that show up in automated extraction pipelines.
 # We block these from fuzzy matching AND from creating new canonical entities.
 NOISE_SUBSTRINGS = [
@@ -141,6 +149,26 @@ def get_short_name(name: str) -> str:
     return f"{parts[0]} {parts[-1]}"
 
 
+def token_sorted_length(name: str) -> int:
+    """Length of a name as token_sort_ratio compares it (tokens joined by single spaces)."""
+    return len(" ".join(name.split()))
+
+
+def fuzzy_length_band(length: int, threshold: float) -> Tuple[int, int]:
+    """Range of token-sorted lengths a name can have and still score >= threshold
+    against a name of the given length.
+
+    token_sort_ratio is 100 * (1 - indel_distance / (len_a + len_b)), and the
+    distance is at least |len_a - len_b|, so lengths outside this band can
+    never reach the threshold. The band is rounded outwards.
+    """
+    slack = 1 - threshold / 100
+    if slack >= 1:
+        return 0, sys.maxsize
+    return (math.floor(length * (1 - slack) / (1 + slack)),
+            math.ceil(length * (1 + slack) / (1 - slack)))
+
+
 def is_numbered_reference(name: str) -> bool:
     """Check if name is a numbered reference (Jane Doe #1, Employee-2, etc.)"""
     return bool(NUMBERED_PATTERN.search(name))
@@ -175,6 +203,11 @@ class EntityResolver:
         # Precompute the name list for rapidfuzz
         self._name_strings = [n[0] for n in self.all_names]
 
+        # normalized query -> best fuzzy hit (extractOne-style tuple or None)
+        # among the first _primed_upto names, filled by prime_fuzzy
+        self._fuzzy_primed = {}
+        self._primed_upto = 0
+
     def _index_name(self, name: str, canonical_id: str) -> None:
         """Index a name in all lookup structures, including normalized forms."""
         # Raw form
@@ -234,12 +267,27 @@ class EntityResolver:
         # Use normalized form for fuzzy matching
         normalized = normalize_name(cleaned)
 
-        result = process.extractOne(
-            normalized,
-            self._name_strings,
-            scorer=fuzz.token_sort_ratio,
-            score_cutoff=self.fuzzy_threshold
-        )
+        if normalized in self._fuzzy_primed:
+            result = self._fuzzy_primed[normalized]
+            # Names are only ever appended, so just the ones indexed since
+            # priming still need scoring; they win only on a strictly higher
+            # score, as extractOne keeps the first best match
+            if len(self._name_strings) > self._primed_upto:
+                later = process.extractOne(
+                    normalized,
+                    self._name_strings[self._primed_upto:],
+                    scorer=fuzz.token_sort_ratio,
+                    score_cutoff=self.fuzzy_threshold
+                )
+                if later and (result is None or later[1] > result[1]):
+                    result = (later[0], later[1], later[2] + self._primed_upto)
+        else:
+            result = process.extractOne(
+                normalized,
+                self._name_strings,
+                scorer=fuzz.token_sort_ratio,
+                score_cutoff=self.fuzzy_threshold
+            )
 
         if result:
             matched_name, score, idx = result
@@ -255,6 +303,67 @@ class EntityResolver:
         # --- No match ---
         return None, "no_match", 0.0
 
+    def prime_fuzzy(self, names: list) -> None:
+        """Precompute the fuzzy (tier 2) matches for many names up front.
+
+        One rapidfuzz.process.cdist call per chunk of names scores them against
+        the registry in C across all cores, instead of an extractOne per name
+        inside resolve(). resolve() then only scores names added to the
+        registry after priming, so results are the same as without priming.
+
+        Chunks are taken in order of name length and scored only against
+        registry names whose length can still reach the threshold (see
+        fuzzy_length_band), which skips most of the registry per chunk.
+        """
+        import bisect
+        import numpy as np
+
+        queries = []
+        for name in names:
+            cleaned = (name or "").strip()
+            if not cleaned or is_noise_entity_name(cleaned) or is_numbered_reference(cleaned):
+                continue
+            if any(form in self.exact_lookup for form in
+                   (cleaned.lower(), normalize_name(cleaned).lower(), get_short_name(cleaned).lower())):
+                continue
+            queries.append(normalize_name(cleaned))
+        queries = sorted(dict.fromkeys(queries), key=token_sorted_length)
+        if not queries or not self._name_strings:
+            return
+
+        choices = self._name_strings
+        # Registry positions ordered by length (stable, so equal lengths keep
+        # registry order), with the lengths alongside for bisecting
+        by_length = sorted(range(len(choices)), key=lambda i: token_sorted_length(choices[i]))
+        lengths = [token_sorted_length(choices[i]) for i in by_length]
+
+        for start in range(0, len(queries), FUZZY_PRIME_CHUNK):
+            chunk = queries[start:start + FUZZY_PRIME_CHUNK]
+            lo, _ = fuzzy_length_band(token_sorted_length(chunk[0]), self.fuzzy_threshold)
+            _, hi = fuzzy_length_band(token_sorted_length(chunk[-1]), self.fuzzy_threshold)
+            positions = by_length[bisect.bisect_left(lengths, lo):bisect.bisect_right(lengths, hi)]
+            if not positions:
+                for query in chunk:
+                    self._fuzzy_primed[query] = None
+                continue
+            scores = process.cdist(chunk, [choices[i] for i in positions], scorer=fuzz.token_sort_ratio,
+                                   score_cutoff=self.fuzzy_threshold, workers=-1)
+            for query, row in zip(chunk, scores):
+                best = row.max()
+                if best == 0:
+                    self._fuzzy_primed[query] = None
+                    continue
+                # cdist scores are float32; rescore the tied candidates at full
+                # precision and keep the first best in registry order, as
+                # extractOne would
+                result = None
+                for idx in sorted(positions[k] for k in np.flatnonzero(row == best)):
+                    score = fuzz.token_sort_ratio(query, choices[idx])
+                    if result is None or score > result[1]:
+                        result = (choices[idx], score, idx)
+                self._fuzzy_primed[query] = result
+        self._primed_upto = len(choices)
+
     def resolve_batch(self, names: list) -> list:
         """Resolve a list of names. Returns list of (name, canonical_id, method, confidence)."""
         results = []
@@ -7,14 +7,26 @@ from __future__ import annotations
 import sqlite3
 import json
 import os
+import pathlib
+from collections import Counter
 from datetime import datetime, timezone
 from typing import Optional, Iterable, Set
 
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is fine, just slower
+    orjson = None
+
 
 # Default paths — all relative to project root
 DEFAULT_DB_PATH = "data/output/ecare.db"
 RAW_DATA_DIR = "data/raw"
 
+# How long a connection waits on another writer's lock before "database is
+# locked". Analysis steps run side by side (run_pipeline.py --jobs) and each
+# logs to pipeline_runs, so a writer may have to wait out another's commit.
+BUSY_TIMEOUT_MS = 60000
+
 
 def ensure_schema(conn: sqlite3.Connection) -> None:
     """Best-effort lightweight migrations so older DBs don't explode.
@@ -47,13 +59,38 @@ def ensure_schema(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE relationship_sources ADD COLUMN evidence_class TEXT")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_relsrc_class ON relationship_sources(evidence_class)")
 
+    # (entity_type, canonical_id) lets per-type scans come back in canonical_id
+    # order without a temp B-tree sort (contradictions, coverage, etc.)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_entities_type_id ON canonical_entities(entity_type, canonical_id)"
+    )
+
+    # Pair lookups in both directions (find_existing_relationship's OR) and
+    # per-system provenance checks on a relationship
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rel_pair_rev ON relationships(target_entity_id, source_entity_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_relsrc_rel_system ON relationship_sources(relationship_id, source_system)"
+    )
+
     conn.commit()
 
 
 def get_db_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
-    """Get a connection to the ECARE database with standard settings."""
+    """Get a connection to the ECARE database with standard settings.
+
+    WAL + synchronous=NORMAL skips the per-commit fsync (still crash-safe in WAL
+    mode), and the larger page cache / mmap window keeps the big analysis joins
+    out of the syscall path.
+    """
     conn = sqlite3.connect(db_path)
     conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")    # 256 MB
+    conn.execute("PRAGMA cache_size=-262144")     # 256 MB (negative = KiB)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
     conn.execute("PRAGMA foreign_keys=ON")
     conn.row_factory = sqlite3.Row
     try:
@@ -65,6 +102,30 @@ def get_db_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
     return conn
 
 
+def get_readonly_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """Read-only connection to the ECARE database, for analysis steps that only
+    read until their final log_pipeline_run (which needs get_db_connection).
+
+    mode=ro takes no write locks and skips ensure_schema; a 1 GB mmap window
+    and ~200 MB page cache keep the relationships scans out of read().
+    """
+    uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=1073741824")   # 1 GB
+    conn.execute("PRAGMA cache_size=-200000")     # ~200 MB (negative = KiB)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def loads_json(raw):
+    """Parse a JSON string (or bytes), using orjson when it's installed."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 def now_iso() -> str:
     """Return current UTC time as ISO string."""
     return datetime.now(timezone.utc).isoformat()
@@ -153,6 +214,26 @@ def insert_relationship_source(conn: sqlite3.Connection, relationship_id: int,
     )
 
 
+def insert_relationship_sources(conn: sqlite3.Connection, rows: Iterable[tuple]) -> None:
+    """Log provenance for many relationships with one prepared statement.
+
+    Each row is (relationship_id, source_system, source_relationship_id,
+    source_relationship_type, source_evidence, source_confidence, evidence_class),
+    same meaning as the insert_relationship_source arguments.
+    """
+    date_added = now_iso()
+    conn.executemany(
+        """INSERT INTO relationship_sources
+           (relationship_id, source_system, source_relationship_id, source_relationship_type,
+            source_evidence, source_confidence, evidence_class, date_added)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((rel_id, system, src_rel_id, src_rel_type,
+          json.dumps(evidence) if evidence else None,
+          confidence, evidence_class, date_added)
+         for rel_id, system, src_rel_id, src_rel_type, evidence, confidence, evidence_class in rows)
+    )
+
+
 def append_relationship_documents(conn: sqlite3.Connection, relationship_id: int,
                                   doc_keys: Iterable[str], *, cap: int = 200) -> None:
     """Append doc_keys to relationships.source_documents JSON array (deduped)."""
@@ -285,3 +366,20 @@ def load_excluded_ids(conn: sqlite3.Connection) -> set:
         except Exception:
             pass
     return excluded
+
+
+def load_entity_degrees(conn: sqlite3.Connection) -> Counter:
+    """Relationship count per entity (as source or target), as a Counter.
+
+    One grouped count per endpoint column, each an index-only scan
+    (idx_rel_source / idx_rel_target), summed here rather than re-grouping a
+    UNION ALL of the two in SQLite.
+    """
+    degrees = Counter()
+    cur = conn.cursor()
+    cur.row_factory = None  # plain tuples, whatever the connection's row factory
+    for column in ("source_entity_id", "target_entity_id"):
+        for cid, count in cur.execute(
+                f"SELECT {column}, COUNT(*) FROM relationships GROUP BY {column}"):
+            degrees[cid] += count
+    return degrees
@@ -24,6 +24,7 @@ CREATE TABLE IF NOT EXISTS canonical_entities (
     notes TEXT
 );
 CREATE INDEX IF NOT EXISTS idx_entities_type ON canonical_entities(entity_type);
+CREATE INDEX IF NOT EXISTS idx_entities_type_id ON canonical_entities(entity_type, canonical_id);
 CREATE INDEX IF NOT EXISTS idx_entities_name ON canonical_entities(canonical_name);
 
 CREATE TABLE IF NOT EXISTS entity_resolution_log (
@@ -62,6 +63,7 @@ CREATE INDEX IF NOT EXISTS idx_rel_source ON relationships(source_entity_id);
 CREATE INDEX IF NOT EXISTS idx_rel_target ON relationships(target_entity_id);
 CREATE INDEX IF NOT EXISTS idx_rel_type ON relationships(relationship_type);
 CREATE INDEX IF NOT EXISTS idx_rel_pair ON relationships(source_entity_id, target_entity_id);
+CREATE INDEX IF NOT EXISTS idx_rel_pair_rev ON relationships(target_entity_id, source_entity_id);
 
 CREATE TABLE IF NOT EXISTS relationship_sources (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -76,6 +78,7 @@ CREATE TABLE IF NOT EXISTS relationship_sources (
     FOREIGN KEY (relationship_id) REFERENCES relationships(relationship_id)
 );
 CREATE INDEX IF NOT EXISTS idx_relsrc_rel ON relationship_sources(relationship_id);
+CREATE INDEX IF NOT EXISTS idx_relsrc_rel_system ON relationship_sources(relationship_id, source_system);
 CREATE INDEX IF NOT EXISTS idx_relsrc_system ON relationship_sources(source_system);
 CREATE INDEX IF NOT EXISTS idx_relsrc_class ON relationship_sources(evidence_class);
 
@@ -22,16 +22,33 @@ This module:
 
 from __future__ import annotations
 
+import functools
 import hashlib
 import re
 import sqlite3
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
 EFTA_RE = re.compile(r"\b(EFTA\d{6,})\b", re.IGNORECASE)
 # Allow DOJ OGR in a bunch of sloppy formats: "doj-ogr-123", "DOJ_OGR_00001234", etc.
 DOJ_OGR_RE = re.compile(r"\bDOJ[\s\-_]?OGR[\s\-_]?(\d{1,12})\b", re.IGNORECASE)
+# Either of the above, for a single-pass "does this string hold a doc ref?" check
+DOC_REF_RE = re.compile(f"{EFTA_RE.pattern}|{DOJ_OGR_RE.pattern}", re.IGNORECASE)
+
+UPSERT_DOCUMENT_ID_SQL = """
+    INSERT INTO document_ids
+        (doc_key, efta_number, doj_ogr_id, source_system, raw_id, confidence, notes, last_updated)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(doc_key) DO UPDATE SET
+        efta_number = COALESCE(excluded.efta_number, document_ids.efta_number),
+        doj_ogr_id = COALESCE(excluded.doj_ogr_id, document_ids.doj_ogr_id),
+        source_system = COALESCE(excluded.source_system, document_ids.source_system),
+        raw_id = COALESCE(excluded.raw_id, document_ids.raw_id),
+        confidence = COALESCE(excluded.confidence, document_ids.confidence),
+        notes = COALESCE(excluded.notes, document_ids.notes),
+        last_updated = CURRENT_TIMESTAMP
+"""
 
 
 @dataclass(frozen=True)
@@ -73,6 +90,16 @@ def extract_doj_ogr(raw: str) -> Optional[str]:
     return f"DOJ-OGR-{digits}"
 
 
+@functools.lru_cache(maxsize=200_000)
+def parse_raw_id(raw_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """(EFTA, DOJ-OGR) tokens of an already-normalized raw id, memoized.
+
+    Pure string work, so safe to cache; the same document refs repeat across
+    many evidence payloads.
+    """
+    return extract_efta(raw_id), extract_doj_ogr(raw_id)
+
+
 def doc_key_for(efta_number: Optional[str], doj_ogr_id: Optional[str], raw_id: str) -> str:
     if efta_number:
         return efta_number
@@ -101,19 +128,7 @@ def upsert_document_id(
     doc_key and (EFTA, DOJ-OGR), plus where it came from.
     """
     conn.execute(
-        """
-        INSERT INTO document_ids
-            (doc_key, efta_number, doj_ogr_id, source_system, raw_id, confidence, notes, last_updated)
-        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(doc_key) DO UPDATE SET
-            efta_number = COALESCE(excluded.efta_number, document_ids.efta_number),
-            doj_ogr_id = COALESCE(excluded.doj_ogr_id, document_ids.doj_ogr_id),
-            source_system = COALESCE(excluded.source_system, document_ids.source_system),
-            raw_id = COALESCE(excluded.raw_id, document_ids.raw_id),
-            confidence = COALESCE(excluded.confidence, document_ids.confidence),
-            notes = COALESCE(excluded.notes, document_ids.notes),
-            last_updated = CURRENT_TIMESTAMP
-        """,
+        UPSERT_DOCUMENT_ID_SQL,
         (doc_key, efta_number, doj_ogr_id, source_system, raw_id, confidence, notes),
     )
 
@@ -183,6 +198,70 @@ def canonicalize_doc_ref(
     return DocTokens(doc_key=doc_key, raw_id=raw_id, efta_number=efta, doj_ogr_id=ogr)
 
 
+def canonicalize_doc_refs(
+    conn: sqlite3.Connection,
+    raw_ids: Iterable[str],
+    *,
+    source_system: Optional[str] = None,
+    confidence: float = 0.5,
+    notes: Optional[str] = None,
+    written: Optional[Dict[str, tuple]] = None,
+) -> List[DocTokens]:
+    """canonicalize_doc_ref for many raw ids at once (duplicates collapsed).
+
+    Same rules, but the DOJ-OGR -> EFTA lookups go out as one IN (...) query and
+    the document_ids upserts as one executemany.
+
+    `written` (doc_key -> last upsert parameters) can be shared across calls by
+    a caller that is the only writer for the duration: an upsert identical to
+    the previous one for the same doc_key changes nothing and is skipped.
+    """
+    parsed = []
+    for raw_id in dict.fromkeys(normalize_raw_id(r) for r in raw_ids):
+        parsed.append((raw_id, *parse_raw_id(raw_id)))
+    if not parsed:
+        return []
+
+    ogr_only = sorted({ogr for _, efta, ogr in parsed if ogr and not efta})
+    mapped = {}
+    if ogr_only:
+        rows = conn.execute(
+            f"""SELECT doj_ogr_id, efta_number FROM document_ids
+                WHERE doj_ogr_id IN ({",".join("?" * len(ogr_only))}) AND efta_number IS NOT NULL""",
+            ogr_only,
+        ).fetchall()
+        for ogr, efta in rows:
+            mapped.setdefault(ogr, efta)
+
+    tokens = []
+    upserts = []
+    for raw_id, efta, ogr in parsed:
+        if efta:
+            doc_key = efta
+            if ogr:
+                # Same as the one-at-a-time path: this upsert records the mapping
+                # for any later OGR-only ref in the batch
+                mapped.setdefault(ogr, efta)
+        elif ogr:
+            doc_key = mapped.get(ogr) or ogr
+        else:
+            doc_key = doc_key_for(None, None, raw_id)
+        upsert = (
+            doc_key,
+            efta if efta else (doc_key if doc_key.startswith("EFTA") else None),
+            ogr, source_system, raw_id if raw_id else None, confidence, notes,
+        )
+        if written is None or written.get(doc_key) != upsert:
+            upserts.append(upsert)
+            if written is not None:
+                written[doc_key] = upsert
+        tokens.append(DocTokens(doc_key=doc_key, raw_id=raw_id, efta_number=efta, doj_ogr_id=ogr))
+
+    if upserts:
+        conn.executemany(UPSERT_DOCUMENT_ID_SQL, upserts)
+    return tokens
+
+
 def canonicalize_doc_fields(
     conn: sqlite3.Connection,
     *,